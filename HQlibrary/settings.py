@@ -75,9 +75,11 @@ from corsheaders.defaults import default_headers
 
 CORS_ALLOW_HEADERS = list(default_headers) + [
     'access-control-allow-origin',
+    'if-none-match',
+    'if-modified-since',
 ]
 
-CORS_EXPOSE_HEADERS = ['Content-Disposition']
+CORS_EXPOSE_HEADERS = ['Content-Disposition', 'ETag', 'Last-Modified']
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
@@ -97,6 +99,40 @@ SIMPLE_JWT = {
     'BLACKLIST_AFTER_ROTATION': True,
 }
 
+# Índice de búsqueda en memoria para el catálogo (ver api/indice_busqueda.py)
+BUSQUEDA_EN_MEMORIA = os.getenv('BUSQUEDA_EN_MEMORIA', 'False') == 'True'
+BUSQUEDA_EN_MEMORIA_TTL = int(os.getenv('BUSQUEDA_EN_MEMORIA_TTL', 300))  # segundos
+# Por encima de tantos resultados el filtro de texto vuelve a hacerse en SQL (evita IN enormes)
+BUSQUEDA_EN_MEMORIA_MAX_IDS = int(os.getenv('BUSQUEDA_EN_MEMORIA_MAX_IDS', 1000))
+
+# Caché de respuestas públicas del catálogo (ver api/cache.py). Sin CACHES se usa la
+# caché local en memoria de Django: cada proceso guarda sus propias respuestas, y la versión
+# del catálogo incluye un sello leído de la base de datos para ver las escrituras de los demás
+# procesos y de los comandos. Con varios procesos conviene un backend compartido (Redis, Memcached).
+CACHE_CATALOGO_TIMEOUT = int(os.getenv('CACHE_CATALOGO_TIMEOUT', 300))  # segundos
+
+# Alta de ejemplares nuevos como un único registro de stock con contador de unidades
+# (Ejemplar.unidades) en lugar de una fila por copia. Se puede forzar por petición con ?agrupar=
+STOCK_NUEVO_AGRUPADO = os.getenv('STOCK_NUEVO_AGRUPADO', 'False') == 'True'
+
+# Máximo de ejemplares que se pueden crear en una sola petición (crear_libro / agregar_ejemplar)
+# y tamaño de cada INSERT múltiple
+MAX_EJEMPLARES_POR_SOLICITUD = int(os.getenv('MAX_EJEMPLARES_POR_SOLICITUD', 1000))
+TAMANO_LOTE_EJEMPLARES = int(os.getenv('TAMANO_LOTE_EJEMPLARES', 500))
+
+# Máximo de elementos (agregar + quitar) por petición a carrito/lote/
+MAX_ITEMS_POR_LOTE_CARRITO = int(os.getenv('MAX_ITEMS_POR_LOTE_CARRITO', 100))
+
+# Seguir escribiendo la copia JSON Cliente.historial_compras en cada compra (solo para integraciones
+# antiguas que la lean directamente; la API la deriva de los pedidos)
+HISTORIAL_COMPRAS_LEGACY = os.getenv('HISTORIAL_COMPRAS_LEGACY', 'False') == 'True'
+
+# QR de devolución (ver api/qr.py): por defecto se renderizan en la primera descarga. Con
+# QR_PRERENDER se generan al crear la devolución, en un pool de hilos si QR_ASINCRONO está activo.
+QR_PRERENDER = os.getenv('QR_PRERENDER', 'False') == 'True'
+QR_ASINCRONO = os.getenv('QR_ASINCRONO', 'True') == 'True'
+QR_WORKERS = int(os.getenv('QR_WORKERS', 2))
+
 ROOT_URLCONF = 'HQlibrary.urls'
 
 TEMPLATES = [
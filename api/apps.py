@@ -4,6 +4,8 @@ class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
 
+    def ready(self):
+        from . import signals  # noqa: F401
 
     # Solo se ejecuta una vez al iniciar el servidor
     # def ready(self):
@@ -0,0 +1,35 @@
+import unicodedata
+
+from django.db.models import Q
+
+
+def normalizar(texto):
+    if not texto:
+        return ""
+    texto = unicodedata.normalize('NFD', texto)
+    texto = ''.join(c for c in texto if unicodedata.category(c) != 'Mn')  # elimina tildes
+    return texto.lower().strip()
+
+
+def texto_busqueda(texto):
+    # Forma guardada en las columnas *_busqueda: palabras normalizadas separadas por un solo espacio
+    return ' '.join(normalizar(texto).split())
+
+
+def filtro_prefijo_palabra(campo, subtexto):
+    """
+    Equivalente en SQL de "alguna palabra del texto empieza por el subtexto",
+    sobre una columna generada con texto_busqueda().
+    """
+    subtexto = normalizar(subtexto)
+
+    # Un subtexto vacío coincide con cualquier texto que tenga al menos una palabra
+    if not subtexto:
+        return ~Q(**{campo: ''})
+
+    # Una palabra nunca contiene espacios, así que un subtexto con varias palabras no coincide con nada
+    if len(subtexto.split()) != 1:
+        return Q(pk__in=[])
+
+    # Primera palabra (puede usar el índice) o cualquier palabra posterior
+    return Q(**{f'{campo}__startswith': subtexto}) | Q(**{f'{campo}__contains': ' ' + subtexto})
@@ -0,0 +1,142 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Subquery
+from django.utils import timezone
+from rest_framework.response import Response
+
+from .busqueda import normalizar
+
+CLAVE_VERSION = 'catalogo:version'
+CLAVE_MODIFICADO = 'catalogo:modificado'
+CLAVE_ACIERTOS = 'catalogo:cache:aciertos'
+CLAVE_FALLOS = 'catalogo:cache:fallos'
+
+# Parámetros que los endpoints comparan ya normalizados: "Garcia", " garcía" y "GARCÍA" comparten entrada
+PARAMETROS_NORMALIZADOS = {'q', 'titulo', 'autor', 'genero'}
+
+
+def _contador_catalogo():
+    version = cache.get(CLAVE_VERSION)
+    if version is None:
+        # Si la clave no existe (primer uso o expulsada de la caché) se parte de un valor basado
+        # en el reloj, para no reutilizar versiones con respuestas viejas guardadas.
+        cache.add(CLAVE_VERSION, time.time_ns(), timeout=None)
+        cache.add(CLAVE_MODIFICADO, timezone.now(), timeout=None)
+        version = cache.get(CLAVE_VERSION)
+    return version
+
+
+def sello_catalogo(request=None):
+    """
+    Última modificación de un libro (o de su resumen de ejemplares, ver recalcular_resumen y
+    aplicar_variacion) y última noticia, leídas de la base de datos en una consulta por índices.
+    Con `request` se lee una sola vez por petición.
+    """
+    from .models import Libro, Noticia
+
+    peticion = getattr(request, '_request', request)  # el HttpRequest detrás del Request de DRF
+    sello = getattr(peticion, '_sello_catalogo', None)
+    if sello is None:
+        ultima_noticia = Noticia.objects.order_by('-fecha_creacion').values('fecha_creacion')[:1]
+        sello = (
+            Libro.objects.order_by('-actualizado')
+            .annotate(ultima_noticia=Subquery(ultima_noticia))
+            .values_list('actualizado', 'ultima_noticia')
+            .first()
+        ) or (None, None)
+        if peticion is not None:
+            peticion._sello_catalogo = sello
+    return sello
+
+
+def version_catalogo(request=None):
+    """
+    Versión del catálogo para las claves de caché: el contador en caché, que cambia al
+    confirmarse cualquier escritura de este proceso (también borrados), junto con el sello de
+    la base de datos, que recoge las escrituras de otros procesos y de los comandos aunque la
+    caché sea local a cada proceso (LocMem, la de Django sin CACHES).
+    """
+    marcas = [int(fecha.timestamp() * 1000000) if fecha else 0 for fecha in sello_catalogo(request)]
+    return '-'.join(str(valor) for valor in [_contador_catalogo(), *marcas])
+
+
+def ultima_modificacion_catalogo(request=None):
+    # La más reciente entre la de este proceso (incluye borrados) y la de la base de datos
+    fechas = [fecha for fecha in (cache.get(CLAVE_MODIFICADO), *sello_catalogo(request)) if fecha]
+    return max(fechas) if fechas else None
+
+
+def incrementar_version_catalogo():
+    try:
+        cache.incr(CLAVE_VERSION)
+    except ValueError:
+        _contador_catalogo()
+    cache.set(CLAVE_MODIFICADO, timezone.now(), timeout=None)
+
+
+def _contar(clave):
+    try:
+        cache.incr(clave)
+    except ValueError:
+        cache.add(clave, 0, timeout=None)
+        try:
+            cache.incr(clave)
+        except ValueError:
+            pass
+
+
+def estadisticas_cache():
+    aciertos = cache.get(CLAVE_ACIERTOS, 0)
+    fallos = cache.get(CLAVE_FALLOS, 0)
+    total = aciertos + fallos
+    return {
+        'version': version_catalogo(),
+        'aciertos': aciertos,
+        'fallos': fallos,
+        'tasa_aciertos': round(aciertos / total, 4) if total else None,
+    }
+
+
+def clave_parametros(request, kwargs=None, excluir=()):
+    """Representación estable de los parámetros de la consulta (ordenados, sin vacíos, normalizados)."""
+    parametros = []
+    for nombre in sorted(request.GET.keys()):
+        if nombre in excluir:
+            continue
+        for valor in request.GET.getlist(nombre):
+            valor = normalizar(valor) if nombre in PARAMETROS_NORMALIZADOS else valor.strip()
+            if valor:
+                parametros.append(f'{nombre}={valor}')
+    for nombre, valor in sorted((kwargs or {}).items()):
+        parametros.append(f'{nombre}={valor}')
+    return hashlib.md5('&'.join(parametros).encode('utf-8')).hexdigest()
+
+
+def respuesta_cacheada(prefijo):
+    """
+    Cachea el `data` de las respuestas 200 de una vista GET pública. La clave incluye la
+    versión del catálogo, que cambia con cada escritura en Libro, Ejemplar o Noticia (de
+    este proceso o de cualquier otro, ver version_catalogo), así que nunca hace falta borrar
+    entradas: las viejas simplemente dejan de consultarse.
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(request, *args, **kwargs):
+            clave = f'respuesta:{prefijo}:{version_catalogo(request)}:{clave_parametros(request, kwargs)}'
+            data = cache.get(clave)
+            if data is not None:
+                _contar(CLAVE_ACIERTOS)
+                return Response(data, headers={'X-Cache': 'HIT'})
+
+            _contar(CLAVE_FALLOS)
+            response = vista(request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(clave, response.data, getattr(settings, 'CACHE_CATALOGO_TIMEOUT', 300))
+            response['X-Cache'] = 'MISS'
+            return response
+        return envoltura
+    return decorador
@@ -0,0 +1,60 @@
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from .models import Carrito, CarritoItem, Ejemplar
+
+
+def _error(clave, valor, mensaje):
+    return {clave: valor, 'resultado': 'error', 'error': mensaje}
+
+
+def agregar_en_lote(carrito, solicitados):
+    """
+    Agrega varios ejemplares al carrito: una consulta trae disponibilidad y presencia en el
+    carrito de todos ellos, y un bulk_create inserta los válidos. `solicitados` es una lista de
+    (ejemplar_id, cantidad) ya convertidos a enteros. Devuelve un resultado por ejemplar, en orden.
+    """
+    ejemplares = {
+        ejemplar.id: ejemplar
+        for ejemplar in Ejemplar.objects.filter(id__in={ejemplar_id for ejemplar_id, _ in solicitados}).annotate(
+            en_carrito=Exists(CarritoItem.objects.filter(carrito=carrito, ejemplar=OuterRef('pk')))
+        )
+    }
+
+    resultados = []
+    nuevos = []
+    vistos = set()
+    for ejemplar_id, cantidad in solicitados:
+        ejemplar = ejemplares.get(ejemplar_id)
+        if ejemplar is None:
+            resultados.append(_error('ejemplar_id', ejemplar_id, 'Ejemplar no encontrado.'))
+        elif ejemplar.en_carrito or ejemplar_id in vistos:
+            resultados.append(_error('ejemplar_id', ejemplar_id, 'Este ejemplar ya está en tu carrito.'))
+        elif not ejemplar.comprobar_disponibilidad(cantidad):
+            # Solo los no disponibles hacen consultas extra (reservas vencidas que aún lo retienen)
+            resultados.append(_error('ejemplar_id', ejemplar_id, 'Este ejemplar no está disponible.'))
+        else:
+            vistos.add(ejemplar_id)
+            nuevos.append(CarritoItem(carrito=carrito, ejemplar=ejemplar, cantidad=cantidad))
+            resultados.append({'ejemplar_id': ejemplar_id, 'resultado': 'agregado'})
+
+    if nuevos:
+        with transaction.atomic():
+            CarritoItem.objects.bulk_create(nuevos)
+            # bulk_create no pasa por CarritoItem.save
+            Carrito.objects.recalcular_totales([carrito.pk])
+    return resultados
+
+
+def quitar_en_lote(carrito, item_ids):
+    """Quita varios items del carrito con un DELETE. Devuelve un resultado por item, en orden."""
+    with transaction.atomic():
+        existentes = set(carrito.items.filter(id__in=item_ids).values_list('id', flat=True))
+        if existentes:
+            carrito.items.filter(id__in=existentes).delete()
+            Carrito.objects.recalcular_totales([carrito.pk])
+    return [
+        {'item_id': item_id, 'resultado': 'eliminado'} if item_id in existentes
+        else _error('item_id', item_id, 'Item no encontrado en tu carrito.')
+        for item_id in item_ids
+    ]
@@ -0,0 +1,150 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, Count, IntegerField, Value, When
+
+from .busqueda import normalizar, filtro_prefijo_palabra
+from .cache import clave_parametros, version_catalogo
+from .indice_busqueda import busqueda_en_memoria_activa, obtener_indice
+from .models import Libro
+
+# Límites de los rangos de precio de las facetas (sobre el ejemplar más barato de cada libro)
+LIMITES_RANGOS_PRECIO = (20000, 50000, 100000)
+
+# Parámetros que no cambian el conjunto filtrado, solo la página o la forma de la respuesta
+PARAMETROS_NO_FILTRO = {'page', 'page_size', 'cursor', 'paginacion', 'facetas'}
+
+
+def filtrar_catalogo(parametros):
+    genero = parametros.get('genero')
+    palabra = parametros.get('q', "")
+    titulo = parametros.get('titulo', "")
+    autor = parametros.get('autor', "")
+    precio_min = parametros.get('precio_min')
+    precio_max = parametros.get('precio_max')
+    destacado = parametros.get('destacado')
+
+    # Los filtros de texto usan las columnas normalizadas de Libro (ver api/busqueda.py),
+    # así el filtrado y la paginación se hacen en la base de datos.
+    libros = Libro.objects.filter(activo=True, ejemplares_disponibles__gt=0)
+
+    # Filtro por género
+    if genero:
+        libros = libros.filter(genero_busqueda=normalizar(genero))
+
+    ids = None
+    if busqueda_en_memoria_activa() and (palabra or titulo or autor):
+        # Los filtros de texto se resuelven como intersección de conjuntos de ids en el índice en memoria
+        indice = obtener_indice()
+        if palabra:
+            ids = indice.buscar('titulo', palabra) | indice.buscar('autor', palabra)
+        if titulo:
+            ids = indice.buscar('titulo', titulo) if ids is None else ids & indice.buscar('titulo', titulo)
+        if autor:
+            ids = indice.buscar('autor', autor) if ids is None else ids & indice.buscar('autor', autor)
+        # Un IN con miles de ids cuesta más que el filtro por prefijo en SQL
+        if len(ids) > getattr(settings, 'BUSQUEDA_EN_MEMORIA_MAX_IDS', 1000):
+            ids = None
+
+    if ids is not None:
+        libros = libros.filter(id__in=ids)
+    else:
+        # Filtro por palabra general q (titulo o autor)
+        if palabra:
+            libros = libros.filter(
+                filtro_prefijo_palabra('titulo_busqueda', palabra) | filtro_prefijo_palabra('autor_busqueda', palabra)
+            )
+
+        # Filtro por autor y/o título específicos
+        if titulo:
+            libros = libros.filter(filtro_prefijo_palabra('titulo_busqueda', titulo))
+        if autor:
+            libros = libros.filter(filtro_prefijo_palabra('autor_busqueda', autor))
+
+    # Filtros por precio: algún ejemplar cuesta al menos precio_min / a lo sumo precio_max
+    if precio_min:
+        try:
+            precio_min = float(precio_min)
+            libros = libros.filter(precio_max__gte=precio_min)
+        except ValueError:
+            pass
+
+    if precio_max:
+        try:
+            precio_max = float(precio_max)
+            libros = libros.filter(precio_min__lte=precio_max)
+        except ValueError:
+            pass
+
+    # Filtro por destacados
+    if destacado is not None:
+        if destacado.lower() in ['true', '1']:
+            libros = libros.filter(destacado=True)
+        elif destacado.lower() in ['false', '0']:
+            libros = libros.filter(destacado=False)
+
+    return libros
+
+
+def _rangos_precio():
+    limites = (0,) + LIMITES_RANGOS_PRECIO + (None,)
+    return [(i, limites[i], limites[i + 1]) for i in range(len(limites) - 1)]
+
+
+def calcular_facetas(libros):
+    """
+    Conteos por género, categoría, idioma y rango de precio del conjunto filtrado.
+    Se hace un único GROUP BY por la combinación de las cuatro dimensiones; el número
+    de combinaciones es pequeño, así que sumarlas por faceta en Python es barato.
+    """
+    rango_precio = Case(
+        *[
+            When(precio_min__gte=desde, then=Value(i)) if hasta is None
+            else When(precio_min__gte=desde, precio_min__lt=hasta, then=Value(i))
+            for i, desde, hasta in _rangos_precio()
+        ],
+        default=Value(None),
+        output_field=IntegerField(),
+    )
+    filas = (
+        libros.order_by()
+        .annotate(rango_precio=rango_precio)
+        .values('genero', 'categoria', 'idioma', 'rango_precio')
+        .annotate(total=Count('id'))
+    )
+
+    generos, categorias, idiomas, rangos = {}, {}, {}, {}
+    for fila in filas:
+        # Los géneros se agrupan igual que los filtra el catálogo (sin tildes ni mayúsculas)
+        clave_genero = normalizar(fila['genero'])
+        valor, total = generos.get(clave_genero, (fila['genero'], 0))
+        generos[clave_genero] = (valor, total + fila['total'])
+        categorias[fila['categoria']] = categorias.get(fila['categoria'], 0) + fila['total']
+        idiomas[fila['idioma']] = idiomas.get(fila['idioma'], 0) + fila['total']
+        if fila['rango_precio'] is not None:
+            rangos[fila['rango_precio']] = rangos.get(fila['rango_precio'], 0) + fila['total']
+
+    def ordenar(conteos):
+        return [
+            {'valor': valor, 'total': total}
+            for valor, total in sorted(conteos, key=lambda item: (-item[1], item[0]))
+        ]
+
+    return {
+        'genero': ordenar(generos.values()),
+        'categoria': ordenar(categorias.items()),
+        'idioma': ordenar(idiomas.items()),
+        'precio': [
+            {'desde': desde, 'hasta': hasta, 'total': rangos.get(i, 0)}
+            for i, desde, hasta in _rangos_precio()
+        ],
+    }
+
+
+def facetas_catalogo(request, libros):
+    # Entrada propia en la caché: no depende de la página pedida, solo de los filtros
+    clave = f'facetas:{version_catalogo(request)}:{clave_parametros(request, excluir=PARAMETROS_NO_FILTRO)}'
+    facetas = cache.get(clave)
+    if facetas is None:
+        facetas = calcular_facetas(libros)
+        cache.set(clave, facetas, getattr(settings, 'CACHE_CATALOGO_TIMEOUT', 300))
+    return facetas
@@ -0,0 +1,108 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Carrito, Cliente, Ejemplar, Pedido, PedidoItem, Reserva, entrada_historial
+
+
+class CompraEnConflicto(Exception):
+    def __init__(self, conflictos):
+        super().__init__('Algunos ejemplares del carrito ya no están disponibles.')
+        self.conflictos = conflictos
+
+
+def _conflictos(items, ejemplares):
+    conflictos = []
+    for item in items:
+        ejemplar = ejemplares.get(item.ejemplar_id)
+        if ejemplar is None or not ejemplar.es_reclamable(item.cantidad):
+            conflictos.append({
+                'item_id': item.id,
+                'ejemplar_id': item.ejemplar_id,
+                'error': 'Este ejemplar ya no está disponible.',
+            })
+    return conflictos
+
+
+def _leer_ejemplares(ejemplar_ids):
+    return {ejemplar.id: ejemplar for ejemplar in Ejemplar.objects.filter(id__in=ejemplar_ids)}
+
+
+def procesar_compra(cliente, carrito, direccion_id, metodo_pago_id):
+    """
+    Compra todos los items del carrito en una sola transacción (ver _comprar). Si hay conflictos
+    y alguno se debe a reservas vencidas que el barredor aún no procesó, las expira y reintenta
+    una vez.
+    """
+    try:
+        return _comprar(cliente, carrito, direccion_id, metodo_pago_id)
+    except CompraEnConflicto as conflicto:
+        ejemplar_ids = [c['ejemplar_id'] for c in conflicto.conflictos]
+        if not Reserva.objects.filter(ejemplar_id__in=ejemplar_ids).expirar():
+            raise
+    return _comprar(cliente, carrito, direccion_id, metodo_pago_id)
+
+
+def _comprar(cliente, carrito, direccion_id, metodo_pago_id):
+    """
+    Compra todos los items del carrito en una sola transacción.
+
+    Los ejemplares se reclaman con un UPDATE condicional por cada cantidad distinta en el
+    carrito (normalmente uno solo, ver Ejemplar.objects.reclamar): si alguno ya no se podía
+    vender, el número de filas reclamadas no coincide, se deshace todo y se lanza
+    CompraEnConflicto con el detalle por item. Las líneas del pedido se crean con bulk_create.
+    """
+    items = list(carrito.items.order_by('id'))
+    ejemplar_ids = sorted({item.ejemplar_id for item in items})
+
+    try:
+        with transaction.atomic():
+            ejemplares = _leer_ejemplares(ejemplar_ids)
+            conflictos = _conflictos(items, ejemplares)
+            if conflictos:
+                raise CompraEnConflicto(conflictos)
+
+            por_cantidad = defaultdict(list)
+            for item in items:
+                por_cantidad[item.cantidad].append(item.ejemplar_id)
+            for cantidad, ids in por_cantidad.items():
+                if Ejemplar.objects.filter(id__in=ids).reclamar(cantidad) != len(ids):
+                    # Otro comprador ganó algún ejemplar entre la lectura y el UPDATE
+                    raise CompraEnConflicto([])
+
+            total = sum(ejemplares[item.ejemplar_id].precio * item.cantidad for item in items)
+
+            pedido = Pedido.objects.create(
+                cliente=cliente,
+                direccion_id=direccion_id,
+                metodo_pago_id=metodo_pago_id,
+                total=total,
+            )
+            PedidoItem.objects.bulk_create([
+                PedidoItem(
+                    pedido=pedido,
+                    ejemplar_id=item.ejemplar_id,
+                    cantidad=item.cantidad,
+                    precio_unitario=ejemplares[item.ejemplar_id].precio,
+                )
+                for item in items
+            ])
+
+            carrito.items.filter(id__in=[item.id for item in items]).delete()
+            Carrito.objects.recalcular_totales([carrito.pk])
+
+            # El historial sale de Pedido/PedidoItem; la copia JSON solo se mantiene si se pide
+            if getattr(settings, 'HISTORIAL_COMPRAS_LEGACY', False):
+                cliente = Cliente.objects.select_for_update().only('id', 'historial_compras').get(pk=cliente.pk)
+                cliente.historial_compras.append(
+                    entrada_historial(pedido, [ejemplares[ejemplar_id] for ejemplar_id in ejemplar_ids])
+                )
+                cliente.save(update_fields=['historial_compras'])
+    except CompraEnConflicto as conflicto:
+        if conflicto.conflictos:
+            raise
+        # La transacción ya se deshizo: releer para informar qué items fallaron
+        raise CompraEnConflicto(_conflictos(items, _leer_ejemplares(ejemplar_ids)))
+
+    return pedido
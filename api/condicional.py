@@ -0,0 +1,41 @@
+from .cache import clave_parametros, version_catalogo, ultima_modificacion_catalogo
+from .models import Libro
+
+# Funciones para django.views.decorators.http.condition: si el cliente envía un
+# If-None-Match/If-Modified-Since vigente se responde 304 sin ejecutar la vista.
+
+
+def _sello_libro(request, libro_id):
+    # Una sola consulta por petición aunque condition() pida ETag y Last-Modified por separado
+    if not hasattr(request, '_sello_libro'):
+        request._sello_libro = (
+            Libro.objects.filter(id=libro_id, activo=True).values_list('actualizado', flat=True).first()
+        )
+    return request._sello_libro
+
+
+def etag_libro(request, libro_id):
+    sello = _sello_libro(request, libro_id)
+    if sello is None:
+        return None
+    return f'libro-{libro_id}-{int(sello.timestamp() * 1000000)}-{clave_parametros(request)[:12]}'
+
+
+def ultima_modificacion_libro(request, libro_id):
+    return _sello_libro(request, libro_id)
+
+
+def etag_catalogo(request):
+    # version_catalogo incluye el sello de la base de datos: las escrituras de otros procesos
+    # cambian el ETag aunque la caché sea local. Una consulta por petición, compartida con
+    # Last-Modified y con la clave de respuesta_cacheada.
+    return f'catalogo-{version_catalogo(request)}-{clave_parametros(request)[:12]}'
+
+
+def ultima_modificacion_catalogo_request(request):
+    return ultima_modificacion_catalogo(request)
+
+
+def etag_qr(request, devolucion_id, huella):
+    # La huella identifica el contenido del PNG: sirve de ETag sin consultar nada
+    return f'qr-{huella}'
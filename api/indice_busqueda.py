@@ -0,0 +1,190 @@
+import logging
+import sys
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import connection
+
+from .busqueda import normalizar
+
+logger = logging.getLogger(__name__)
+
+
+class IndiceBusqueda:
+    """
+    Índice invertido en memoria sobre Libro.titulo y Libro.autor (solo libros activos).
+
+    Por campo guarda token -> conjunto de ids de libro y una lista ordenada de tokens,
+    de modo que "alguna palabra empieza por X" se resuelve con una búsqueda binaria
+    sobre la lista y la unión de las listas de ids del rango.
+    """
+
+    CAMPOS = ('titulo', 'autor')
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._limpiar()
+
+    def _limpiar(self):
+        self._ids = {campo: {} for campo in self.CAMPOS}          # token -> set(ids)
+        self._tokens = {campo: [] for campo in self.CAMPOS}       # tokens ordenados
+        self._por_libro = {}                                      # id -> {campo: tokens}
+        self._pendientes = None                                   # cambios durante una reconstrucción
+        self.construido_en = None
+
+    # ----- Construcción y mantenimiento -----
+
+    def construir(self):
+        from .models import Libro
+
+        # Se construye aparte, sin el lock, y se intercambia al final: las búsquedas siguen
+        # usando el índice anterior mientras se recorre la tabla de libros
+        nuevo = IndiceBusqueda()
+        with self._lock:
+            self._pendientes = {}
+        libros = Libro.objects.filter(activo=True).values_list('id', 'titulo', 'autor')
+        for libro_id, titulo, autor in libros.iterator(chunk_size=2000):
+            nuevo._agregar(libro_id, {'titulo': titulo, 'autor': autor}, ordenar=False)
+        for campo in self.CAMPOS:
+            nuevo._tokens[campo] = sorted(nuevo._ids[campo])
+
+        with self._lock:
+            self._ids, self._tokens, self._por_libro = nuevo._ids, nuevo._tokens, nuevo._por_libro
+            # Los cambios llegados durante el recorrido pueden no estar en él: se vuelven a aplicar
+            pendientes, self._pendientes = self._pendientes, None
+            for libro_id, libro in pendientes.items():
+                self._quitar(libro_id)
+                if libro is not None and libro.activo:
+                    self._agregar(libro_id, {'titulo': libro.titulo, 'autor': libro.autor})
+            self.construido_en = time.monotonic()
+
+    def actualizar(self, libro):
+        with self._lock:
+            if self._pendientes is not None:
+                self._pendientes[libro.id] = libro
+            if self.construido_en is None:
+                return
+            self._quitar(libro.id)
+            if libro.activo:
+                self._agregar(libro.id, {'titulo': libro.titulo, 'autor': libro.autor})
+
+    def eliminar(self, libro_id):
+        with self._lock:
+            if self._pendientes is not None:
+                self._pendientes[libro_id] = None
+            if self.construido_en is None:
+                return
+            self._quitar(libro_id)
+
+    def _agregar(self, libro_id, textos, ordenar=True):
+        tokens_libro = {}
+        for campo in self.CAMPOS:
+            tokens = frozenset(normalizar(textos[campo]).split())
+            tokens_libro[campo] = tokens
+            for token in tokens:
+                ids = self._ids[campo].get(token)
+                if ids is None:
+                    ids = self._ids[campo][token] = set()
+                    if ordenar:
+                        insort(self._tokens[campo], token)
+                ids.add(libro_id)
+        self._por_libro[libro_id] = tokens_libro
+
+    def _quitar(self, libro_id):
+        tokens_libro = self._por_libro.pop(libro_id, None)
+        if tokens_libro is None:
+            return
+        for campo, tokens in tokens_libro.items():
+            for token in tokens:
+                ids = self._ids[campo][token]
+                ids.discard(libro_id)
+                if not ids:
+                    del self._ids[campo][token]
+                    tokens_ordenados = self._tokens[campo]
+                    del tokens_ordenados[bisect_left(tokens_ordenados, token)]
+
+    # ----- Consultas -----
+
+    def buscar(self, campo, subtexto):
+        """Ids de libros activos con alguna palabra de `campo` que empieza por `subtexto`."""
+        subtexto = normalizar(subtexto)
+        with self._lock:
+            if not subtexto:
+                return {libro_id for libro_id, tokens in self._por_libro.items() if tokens[campo]}
+            if len(subtexto.split()) != 1:
+                return set()
+
+            tokens = self._tokens[campo]
+            resultado = set()
+            i = bisect_left(tokens, subtexto)
+            while i < len(tokens) and tokens[i].startswith(subtexto):
+                resultado |= self._ids[campo][tokens[i]]
+                i += 1
+            return resultado
+
+    # ----- Estadísticas -----
+
+    def memoria(self):
+        """Tamaño aproximado en bytes de las estructuras del índice (sys.getsizeof recursivo superficial)."""
+        with self._lock:
+            total_ids = 0
+            total_tokens = 0
+            for campo in self.CAMPOS:
+                total_tokens += sys.getsizeof(self._tokens[campo]) + sys.getsizeof(self._ids[campo])
+                for token, ids in self._ids[campo].items():
+                    total_tokens += sys.getsizeof(token)
+                    total_ids += sys.getsizeof(ids)
+            total_libros = sys.getsizeof(self._por_libro)
+            for tokens_libro in self._por_libro.values():
+                total_libros += sys.getsizeof(tokens_libro)
+                total_libros += sum(sys.getsizeof(tokens) for tokens in tokens_libro.values())
+            return {
+                'libros': len(self._por_libro),
+                'tokens': {campo: len(self._tokens[campo]) for campo in self.CAMPOS},
+                'bytes_tokens': total_tokens,
+                'bytes_listas_ids': total_ids,
+                'bytes_por_libro': total_libros,
+                'bytes_total': total_tokens + total_ids + total_libros,
+            }
+
+
+indice = IndiceBusqueda()
+
+
+def busqueda_en_memoria_activa():
+    return getattr(settings, 'BUSQUEDA_EN_MEMORIA', False)
+
+
+# Solo una construcción a la vez por proceso. Es un Lock y no un RLock porque lo libera
+# el hilo de la reconstrucción en segundo plano, no el que lo adquirió.
+_construccion_lock = threading.Lock()
+
+
+def _reconstruir_en_segundo_plano():
+    try:
+        indice.construir()
+    except Exception:
+        logger.exception("No se pudo reconstruir el índice de búsqueda")
+    finally:
+        connection.close()
+        _construccion_lock.release()
+
+
+def obtener_indice():
+    # Cada proceso tiene su propio índice: se construye en el primer uso y se
+    # reconstruye pasado BUSQUEDA_EN_MEMORIA_TTL para recoger cambios hechos por otros procesos.
+    if indice.construido_en is None:
+        with _construccion_lock:
+            # Las peticiones que esperaban al lock encuentran el índice ya construido
+            if indice.construido_en is None:
+                indice.construir()
+        return indice
+
+    ttl = getattr(settings, 'BUSQUEDA_EN_MEMORIA_TTL', 300)
+    vencido = ttl and time.monotonic() - indice.construido_en > ttl
+    # Vencido: un solo hilo lo reconstruye en segundo plano y mientras tanto se sirve el anterior
+    if vencido and _construccion_lock.acquire(blocking=False):
+        threading.Thread(target=_reconstruir_en_segundo_plano, name='indice-busqueda', daemon=True).start()
+    return indice
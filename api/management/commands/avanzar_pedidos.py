@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.models import Pedido
+
+
+class Command(BaseCommand):
+    help = (
+        "Avanza el estado de los pedidos vencidos (EN PREPARACION → ENVIADO → ENTREGADO). "
+        "Con --intervalo se queda corriendo y repite cada N segundos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--intervalo', type=float, default=0,
+                            help="Segundos entre ejecuciones. 0 ejecuta una sola vez.")
+
+    def handle(self, *args, **options):
+        intervalo = options['intervalo']
+
+        while True:
+            inicio = time.perf_counter()
+            actualizados = Pedido.objects.avanzar_estados()
+            if actualizados or not intervalo:
+                self.stdout.write(
+                    f"{len(actualizados)} pedidos actualizados en {time.perf_counter() - inicio:.3f} s"
+                )
+            if not intervalo:
+                break
+            # Un proceso de larga duración debe soltar conexiones caídas o vencidas entre ciclos
+            close_old_connections()
+            time.sleep(intervalo)
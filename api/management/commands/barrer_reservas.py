@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.models import Reserva, ReservaQuerySet
+
+
+class Command(BaseCommand):
+    help = (
+        "Expira por lotes las reservas vencidas y libera sus ejemplares. Se puede ejecutar en "
+        "varios nodos a la vez. Con --intervalo se queda corriendo y repite cada N segundos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--intervalo', type=float, default=0,
+                            help="Segundos entre barridos. 0 ejecuta un solo barrido.")
+        parser.add_argument('--lote', type=int, default=ReservaQuerySet.LOTE_EXPIRACION,
+                            help="Reservas por transacción.")
+
+    def handle(self, *args, **options):
+        intervalo = options['intervalo']
+
+        while True:
+            inicio = time.perf_counter()
+            expiradas = Reserva.objects.expirar_todas(lote=options['lote'])
+            if expiradas or not intervalo:
+                self.stdout.write(
+                    f"{expiradas} reservas expiradas en {time.perf_counter() - inicio:.3f} s"
+                )
+            if not intervalo:
+                break
+            close_old_connections()
+            time.sleep(intervalo)
@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.busqueda import normalizar
+from api.indice_busqueda import indice
+from api.models import Libro
+
+
+def contiene(texto, subtexto):
+    # Misma lógica que usaba catalogo_view antes de filtrar en la base de datos
+    texto_normalizado = normalizar(texto)
+    subtexto_normalizado = normalizar(subtexto)
+    return any(palabra.startswith(subtexto_normalizado) for palabra in texto_normalizado.split())
+
+
+class Command(BaseCommand):
+    help = "Compara el filtro por listas por comprensión con el índice de búsqueda en memoria."
+
+    def add_arguments(self, parser):
+        parser.add_argument('consultas', nargs='*', default=['a', 'el', 'garcia', 'cien', 'hist'])
+        parser.add_argument('--repeticiones', type=int, default=5)
+
+    def handle(self, *args, **options):
+        consultas = options['consultas']
+        repeticiones = options['repeticiones']
+
+        inicio = time.perf_counter()
+        indice.construir()
+        self.stdout.write(f"Construcción del índice: {time.perf_counter() - inicio:.3f} s, "
+                          f"{indice.memoria()['bytes_total'] / 1024 / 1024:.2f} MiB")
+
+        for consulta in consultas:
+            inicio = time.perf_counter()
+            for _ in range(repeticiones):
+                libros = Libro.objects.filter(activo=True).only('id', 'titulo', 'autor')
+                esperado = {libro.id for libro in libros
+                            if contiene(libro.titulo, consulta) or contiene(libro.autor, consulta)}
+            lista = (time.perf_counter() - inicio) / repeticiones
+
+            inicio = time.perf_counter()
+            for _ in range(repeticiones):
+                obtenido = indice.buscar('titulo', consulta) | indice.buscar('autor', consulta)
+            en_memoria = (time.perf_counter() - inicio) / repeticiones
+
+            estado = "OK" if esperado == obtenido else "DIFERENTE"
+            self.stdout.write(
+                f"{consulta!r}: {len(obtenido)} libros | listas {lista * 1000:.2f} ms | "
+                f"índice {en_memoria * 1000:.3f} ms | x{lista / en_memoria if en_memoria else 0:.0f} | {estado}"
+            )
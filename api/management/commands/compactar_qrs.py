@@ -0,0 +1,72 @@
+import time
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import Devolucion
+from api.qr import DIRECTORIO_QR, contenido_qr_campos, huella_qr, ruta_qr
+
+
+def recorrer(directorio):
+    # Archivos del almacenamiento bajo `directorio`, recursivamente (vale para cualquier Storage con listdir)
+    subdirectorios, archivos = default_storage.listdir(directorio)
+    for archivo in archivos:
+        yield f"{directorio}/{archivo}"
+    for subdirectorio in subdirectorios:
+        yield from recorrer(f"{directorio}/{subdirectorio}")
+
+
+class Command(BaseCommand):
+    help = (
+        "Borra los QR de devolución huérfanos: archivos de qrs/ que ninguna devolución referencia, ni "
+        "por su codigo_qr ni como QR de su contenido actual (filas borradas). Las devoluciones se "
+        "recorren por lotes; ningún archivo de una fila existente se borra."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=2000, help="Devoluciones por consulta.")
+        parser.add_argument('--antiguedad', type=int, default=60,
+                            help="Minutos: no se tocan archivos más recientes (pueden ser de devoluciones en curso).")
+        parser.add_argument('--dry-run', action='store_true', help="Solo informa, no borra nada.")
+
+    def handle(self, *args, **options):
+        lote = options['lote']
+        simulado = options['dry_run']
+        limite = timezone.now() - timedelta(minutes=options['antiguedad'])
+        inicio = time.perf_counter()
+
+        referenciados = set()
+        ultimo_id = 0
+        while True:
+            filas = list(
+                Devolucion.objects.filter(id__gt=ultimo_id).order_by('id').values_list(
+                    'id', 'cliente__email', 'ejemplar__libro__titulo', 'fecha_solicitud', 'codigo_qr'
+                )[:lote]
+            )
+            if not filas:
+                break
+            for devolucion_id, email, titulo, fecha, codigo_qr in filas:
+                # El archivo que la fila tiene asignado (también uno subido a mano) y el que
+                # obtener_png usaría para su contenido actual
+                referenciados.add(ruta_qr(huella_qr(contenido_qr_campos(devolucion_id, email, titulo, fecha))))
+                if codigo_qr:
+                    referenciados.add(codigo_qr)
+            ultimo_id = filas[-1][0]
+
+        revisados = borrados = 0
+        if default_storage.exists(DIRECTORIO_QR):
+            for ruta in recorrer(DIRECTORIO_QR):
+                revisados += 1
+                if ruta in referenciados or default_storage.get_modified_time(ruta) > limite:
+                    continue
+                borrados += 1
+                if not simulado:
+                    default_storage.delete(ruta)
+
+        accion = "se borrarían" if simulado else "borrados"
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(referenciados)} archivos referenciados, {revisados} revisados, {borrados} huérfanos {accion}, "
+            f"en {time.perf_counter() - inicio:.2f} s"
+        ))
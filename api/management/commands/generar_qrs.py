@@ -0,0 +1,92 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.models import Devolucion
+from api.qr import contenido_qr_campos, huella_qr, renderizar_qr, ruta_qr
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera por lotes los QR de las devoluciones sin codigo_qr, renderizando en paralelo con un "
+        "pool de procesos. Cada lote se guarda y confirma por separado, así que si se interrumpe basta "
+        "con volver a ejecutarlo (o usar --desde-id con el último id informado)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=500, help="Devoluciones por lote.")
+        parser.add_argument('--procesos', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--todas', action='store_true',
+                            help="Regenerar también las que ya tienen QR (p. ej. tras cambiar el formato).")
+        parser.add_argument('--desde-id', type=int, default=0, help="Continuar a partir de este id.")
+
+    def handle(self, *args, **options):
+        lote = options['lote']
+        devoluciones = Devolucion.objects.all()
+        if not options['todas']:
+            devoluciones = devoluciones.filter(codigo_qr='')
+        devoluciones = devoluciones.filter(id__gt=options['desde_id']).order_by('id')
+
+        total = devoluciones.count()
+        self.stdout.write(f"{total} devoluciones por procesar con {options['procesos']} procesos")
+        if not total:
+            return
+
+        inicio = time.perf_counter()
+        procesadas = renderizadas = 0
+        pool_iniciado = False
+        ultimo_id = options['desde_id']
+        with ProcessPoolExecutor(max_workers=options['procesos']) as pool:
+            while True:
+                filas = list(
+                    devoluciones.filter(id__gt=ultimo_id).values_list(
+                        'id', 'cliente__email', 'ejemplar__libro__titulo', 'fecha_solicitud'
+                    )[:lote]
+                )
+                if not filas:
+                    break
+
+                pendientes = []
+                actualizadas = []
+                for devolucion_id, email, titulo, fecha in filas:
+                    contenido = contenido_qr_campos(devolucion_id, email, titulo, fecha)
+                    ruta = ruta_qr(huella_qr(contenido))
+                    actualizadas.append(Devolucion(id=devolucion_id, codigo_qr=ruta, estado_qr=Devolucion.QR_LISTO))
+                    # Mismo contenido, mismo archivo: si ya existe no hace falta renderizarlo
+                    if not default_storage.exists(ruta):
+                        pendientes.append((ruta, contenido))
+
+                if pendientes and not pool_iniciado:
+                    # Con fork, el pool crea sus procesos en el primer envío de trabajo, y la consulta
+                    # del lote ya abrió la conexión: cerrarla justo antes para que los hijos (que no
+                    # usan la base de datos) no hereden el socket. La siguiente consulta abre otra.
+                    connection.close()
+                    pool_iniciado = True
+                pngs = pool.map(renderizar_qr, [contenido for _, contenido in pendientes], chunksize=16)
+                for (ruta, _), png in zip(pendientes, pngs):
+                    guardado = default_storage.save(ruta, ContentFile(png))
+                    if guardado != ruta:
+                        default_storage.delete(guardado)
+
+                # Un UPDATE (CASE por id) para todo el lote
+                Devolucion.objects.bulk_update(actualizadas, ['codigo_qr', 'estado_qr'], batch_size=lote)
+
+                procesadas += len(filas)
+                renderizadas += len(pendientes)
+                ultimo_id = filas[-1][0]
+                duracion = time.perf_counter() - inicio
+                self.stdout.write(
+                    f"{procesadas}/{total} ({procesadas * 100 // total}%) · {renderizadas} renderizados · "
+                    f"{procesadas / duracion:.0f} devoluciones/s · último id {ultimo_id}"
+                )
+
+        duracion = time.perf_counter() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"{procesadas} devoluciones actualizadas ({renderizadas} QR renderizados) en {duracion:.2f} s, "
+            f"{renderizadas / duracion:.0f} QR/s"
+        ))
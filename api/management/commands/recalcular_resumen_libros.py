@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.models import Libro
+
+
+class Command(BaseCommand):
+    help = "Recalcula por lotes el resumen de ejemplares (disponibles, por estado y rango de precios) de cada libro."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000, help="Cantidad de libros por UPDATE.")
+
+    def handle(self, *args, **options):
+        lote = options['lote']
+        inicio = time.perf_counter()
+        actualizados = 0
+        ultimo_id = 0
+
+        while True:
+            ids = list(
+                Libro.objects.filter(id__gt=ultimo_id).order_by('id').values_list('id', flat=True)[:lote]
+            )
+            if not ids:
+                break
+            actualizados += Libro.objects.recalcular_resumen(ids)
+            ultimo_id = ids[-1]
+            self.stdout.write(f"{actualizados} libros recalculados...")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Resumen recalculado para {actualizados} libros en {time.perf_counter() - inicio:.2f} s"
+        ))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.indice_busqueda import indice
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstruye el índice de búsqueda en memoria de títulos y autores y muestra su tamaño. "
+        "Cada proceso del servidor mantiene su propia copia; este comando sirve para medir "
+        "el tiempo de construcción y la memoria que ocupará en cada worker."
+    )
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        indice.construir()
+        duracion = time.perf_counter() - inicio
+
+        memoria = indice.memoria()
+        self.stdout.write(f"Libros indexados: {memoria['libros']}")
+        for campo, cantidad in memoria['tokens'].items():
+            self.stdout.write(f"Tokens distintos en {campo}: {cantidad}")
+        self.stdout.write(f"Memoria aproximada: {memoria['bytes_total'] / 1024 / 1024:.2f} MiB "
+                          f"(tokens {memoria['bytes_tokens']} B, listas de ids {memoria['bytes_listas_ids']} B, "
+                          f"tokens por libro {memoria['bytes_por_libro']} B)")
+        self.stdout.write(self.style.SUCCESS(f"Índice reconstruido en {duracion:.3f} s"))
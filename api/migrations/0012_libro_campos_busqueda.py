@@ -0,0 +1,46 @@
+# Generated by Django 5.1.7 on 2026-10-18 15:44
+
+from django.db import migrations, models
+
+from api.busqueda import normalizar, texto_busqueda
+
+
+def rellenar_campos_busqueda(apps, schema_editor):
+    Libro = apps.get_model('api', 'Libro')
+    libros = []
+    for libro in Libro.objects.only('id', 'titulo', 'autor', 'genero').iterator(chunk_size=1000):
+        libro.titulo_busqueda = texto_busqueda(libro.titulo)
+        libro.autor_busqueda = texto_busqueda(libro.autor)
+        libro.genero_busqueda = normalizar(libro.genero)
+        libros.append(libro)
+        if len(libros) >= 1000:
+            Libro.objects.bulk_update(libros, ['titulo_busqueda', 'autor_busqueda', 'genero_busqueda'])
+            libros = []
+    if libros:
+        Libro.objects.bulk_update(libros, ['titulo_busqueda', 'autor_busqueda', 'genero_busqueda'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_pedido_estado_alter_respuestamensaje_administrador'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='libro',
+            name='autor_busqueda',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=300),
+        ),
+        migrations.AddField(
+            model_name='libro',
+            name='genero_busqueda',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=300),
+        ),
+        migrations.AddField(
+            model_name='libro',
+            name='titulo_busqueda',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=600),
+        ),
+        migrations.RunPython(rellenar_campos_busqueda, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.1.7 on 2026-10-18 15:46
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def calcular_resumen(apps, schema_editor):
+    Libro = apps.get_model('api', 'Libro')
+    Ejemplar = apps.get_model('api', 'Ejemplar')
+
+    def subconsulta(agregado, **filtros):
+        return Subquery(
+            Ejemplar.objects.filter(libro=OuterRef('pk'), **filtros)
+            .order_by().values('libro').annotate(valor=agregado).values('valor')[:1]
+        )
+
+    disponibles = {'disponible': True, 'agotado': False}
+    Libro.objects.update(
+        ejemplares_disponibles=Coalesce(subconsulta(Count('id'), **disponibles), Value(0)),
+        disponibles_nuevo=Coalesce(subconsulta(Count('id'), estado='nuevo', **disponibles), Value(0)),
+        disponibles_usado=Coalesce(subconsulta(Count('id'), estado='usado', **disponibles), Value(0)),
+        precio_min=subconsulta(Min('precio')),
+        precio_max=subconsulta(Max('precio')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_libro_campos_busqueda'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='libro',
+            name='disponibles_nuevo',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='libro',
+            name='disponibles_usado',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='libro',
+            name='ejemplares_disponibles',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='libro',
+            name='precio_max',
+            field=models.DecimalField(db_index=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='libro',
+            name='precio_min',
+            field=models.DecimalField(db_index=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.RunPython(calcular_resumen, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-18 15:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_libro_resumen_ejemplares'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='noticia',
+            name='fecha_creacion',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='mensaje',
+            index=models.Index(fields=['fecha_creacion'], name='mensaje_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mensaje',
+            index=models.Index(fields=['cliente', 'fecha_creacion'], name='mensaje_cliente_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['cliente', 'fecha_creacion'], name='pedido_cliente_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_indices_paginacion_cursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='libro',
+            name='actualizado',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 15:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_libro_actualizado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ejemplar',
+            name='unidades',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
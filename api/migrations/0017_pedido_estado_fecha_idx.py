@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-18 15:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_ejemplar_unidades'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['estado', 'fecha_creacion'], name='pedido_estado_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-18 15:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_pedido_estado_fecha_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['activa', 'fecha_expiracion'], name='reserva_activa_expiracion_idx'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.1.7 on 2026-10-18 15:59
+
+from django.db import migrations, models
+
+
+def rellenar_historial_desde_pedidos(apps, schema_editor):
+    # Deja Cliente.historial_compras como vista derivada de Pedido/PedidoItem (mismo formato que
+    # escribía la compra). Se conservan las entradas antiguas que no corresponden a ningún pedido.
+    Cliente = apps.get_model('api', 'Cliente')
+    Pedido = apps.get_model('api', 'Pedido')
+    PedidoItem = apps.get_model('api', 'PedidoItem')
+
+    cliente_ids = Pedido.objects.order_by('cliente_id').values_list('cliente_id', flat=True).distinct()
+    lote = []
+    for cliente in Cliente.objects.filter(pk__in=cliente_ids).only('pk', 'historial_compras').iterator(chunk_size=500):
+        pedidos = list(Pedido.objects.filter(cliente_id=cliente.pk).order_by('fecha_creacion', 'id'))
+        codigos = {}
+        items = PedidoItem.objects.filter(pedido__cliente_id=cliente.pk, ejemplar__isnull=False)
+        for pedido_id, ejemplar_id, codigo in items.values_list('pedido_id', 'ejemplar_id', 'ejemplar__codigo'):
+            codigos.setdefault(pedido_id, {})[ejemplar_id] = codigo.hex
+
+        derivado = [
+            {
+                "total": str(pedido.total),
+                "fecha": pedido.fecha_creacion.strftime("%Y-%m-%d %H:%M"),
+                "direccion_id": pedido.direccion_id,
+                "metodo_pago_id": pedido.metodo_pago_id,
+                "pedido_id": pedido.id,
+                "ejemplares": [c for _, c in sorted(codigos.get(pedido.id, {}).items())],
+            }
+            for pedido in pedidos
+        ]
+        ids_pedidos = {pedido.id for pedido in pedidos}
+        antiguas = [
+            compra for compra in (cliente.historial_compras or [])
+            if compra.get('pedido_id') not in ids_pedidos
+        ]
+        cliente.historial_compras = antiguas + derivado
+        lote.append(cliente)
+        if len(lote) >= 500:
+            Cliente.objects.bulk_update(lote, ['historial_compras'])
+            lote = []
+    if lote:
+        Cliente.objects.bulk_update(lote, ['historial_compras'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_reserva_activa_expiracion_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pedidoitem',
+            index=models.Index(fields=['ejemplar', 'pedido'], name='pedidoitem_ejemplar_pedido_idx'),
+        ),
+        migrations.RunPython(rellenar_historial_desde_pedidos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:00
+
+from django.db import migrations, models
+
+
+def marcar_qr_existentes(apps, schema_editor):
+    # Las devoluciones anteriores ya tienen su QR generado en la petición
+    Devolucion = apps.get_model('api', 'Devolucion')
+    Devolucion.objects.exclude(codigo_qr='').update(estado_qr='listo')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_pedidoitem_ejemplar_pedido_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='devolucion',
+            name='estado_qr',
+            field=models.CharField(choices=[('pendiente', 'Pendiente'), ('listo', 'Listo'), ('error', 'Error')], default='pendiente', max_length=10),
+        ),
+        migrations.RunPython(marcar_qr_existentes, migrations.RunPython.noop),
+    ]
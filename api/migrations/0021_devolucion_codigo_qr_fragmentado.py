@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:02
+
+import api.qr
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_devolucion_estado_qr'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='devolucion',
+            name='codigo_qr',
+            field=models.ImageField(blank=True, upload_to=api.qr.ruta_subida_qr),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:03
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def calcular_totales(apps, schema_editor):
+    Carrito = apps.get_model('api', 'Carrito')
+    CarritoItem = apps.get_model('api', 'CarritoItem')
+
+    def subconsulta(agregado):
+        return Subquery(
+            CarritoItem.objects.filter(carrito=OuterRef('pk')).order_by()
+            .values('carrito').annotate(valor=agregado).values('valor')[:1]
+        )
+
+    decimal = models.DecimalField(max_digits=12, decimal_places=2)
+    Carrito.objects.update(
+        cantidad_items=Coalesce(subconsulta(Sum('cantidad')), Value(0)),
+        total=Coalesce(subconsulta(Sum(F('cantidad') * F('ejemplar__precio'), output_field=decimal)), Value(0), output_field=decimal),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_devolucion_codigo_qr_fragmentado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carrito',
+            name='cantidad_items',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='carrito',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.RunPython(calcular_totales, migrations.RunPython.noop),
+    ]
@@ -1,14 +1,17 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Count, F, Max, Min, OuterRef, Prefetch, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.core.mail import send_mail
 from django.conf import settings
 import uuid
+from collections import Counter, defaultdict
 from django.utils import timezone
 from datetime import timedelta
-import qrcode
-from io import BytesIO
-from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
+from .busqueda import normalizar, texto_busqueda
+from .cache import incrementar_version_catalogo
+from .qr import encolar_qr, ruta_subida_qr
 
 # ===========================
 #        USUARIOS
@@ -74,20 +77,124 @@ class Cliente(Usuario):
     fecha_nacimiento = models.DateField()
     direccion = models.CharField(max_length=255)
     genero = models.CharField(max_length=50)
+    # Copia heredada del historial: la fuente de verdad son Pedido/PedidoItem (ver historial_desde_pedidos).
+    # Solo se sigue escribiendo al comprar si settings.HISTORIAL_COMPRAS_LEGACY está activo.
     historial_compras = models.JSONField(default=list)
     reservas = models.JSONField(default=list)
     preferencias_literarias = models.JSONField(default=list)
     recibir_noticias = models.BooleanField(default=False)
 
+    DIAS_DEVOLUCION = 8
+
     def editar_perfil(self, nuevos_datos):
         for key, value in nuevos_datos.items():
             setattr(self, key, value)
         self.save()
 
+    def historial_desde_pedidos(self):
+        """Historial de compras con el formato del antiguo JSON historial_compras, a partir de los pedidos."""
+        pedidos = self.pedidos.order_by('fecha_creacion', 'id').prefetch_related(
+            Prefetch('items', queryset=PedidoItem.objects.select_related('ejemplar').order_by('ejemplar_id'))
+        )
+        return [
+            entrada_historial(pedido, [item.ejemplar for item in pedido.items.all() if item.ejemplar])
+            for pedido in pedidos
+        ]
+
+    def puede_devolver(self, ejemplar_id, ahora=None):
+        # Compra del ejemplar por este cliente hace DIAS_DEVOLUCION días completos o menos
+        limite = (ahora or timezone.now()) - timedelta(days=self.DIAS_DEVOLUCION + 1)
+        return PedidoItem.objects.filter(
+            ejemplar_id=ejemplar_id, pedido__cliente=self, pedido__fecha_creacion__gt=limite
+        ).exists()
+
+
+def entrada_historial(pedido, ejemplares):
+    # Una entrada del historial de compras: el pedido y los códigos de sus ejemplares ordenados por id
+    codigos = {ejemplar.id: ejemplar.codigo.hex for ejemplar in ejemplares}
+    return {
+        "total": str(pedido.total),
+        "fecha": pedido.fecha_creacion.strftime("%Y-%m-%d %H:%M"),
+        "direccion_id": pedido.direccion_id,
+        "metodo_pago_id": pedido.metodo_pago_id,
+        "pedido_id": pedido.id,
+        "ejemplares": [codigos[ejemplar_id] for ejemplar_id in sorted(codigos)],
+    }
+
 # ===========================
 #         LIBROS
 # ===========================
 
+def _subconsulta_ejemplares(agregado, **filtros):
+    # Agregado de los ejemplares de cada libro como subconsulta correlacionada (NULL si no hay filas)
+    return Subquery(
+        Ejemplar.objects.filter(libro=OuterRef('pk'), **filtros)
+        .order_by()
+        .values('libro')
+        .annotate(valor=agregado)
+        .values('valor')[:1]
+    )
+
+
+def _sumar_sin_negativos(campo, unidades):
+    # La resta solo se evalúa si no deja el campo por debajo de 0: en MySQL la columna es
+    # UNSIGNED y un resultado negativo es un error, aunque el resumen estuviera desfasado
+    if unidades >= 0:
+        return F(campo) + unidades
+    return Case(When(**{f'{campo}__gte': -unidades}, then=F(campo) - (-unidades)), default=Value(0))
+
+
+class LibroManager(models.Manager):
+    # Estados con contador propio (disponibles_nuevo, disponibles_usado)
+    ESTADOS_RESUMEN = ('nuevo', 'usado')
+
+    def recalcular_resumen(self, libro_ids=None):
+        """
+        Recalcula en un solo UPDATE los agregados de ejemplares (disponibles, por estado,
+        precio mínimo y máximo) de los libros indicados, o de todos si libro_ids es None.
+        Las subconsultas leen todos los ejemplares del libro, así que se reserva para altas y
+        ediciones de ejemplares y para el comando recalcular_resumen_libros; reclamar y liberar
+        usan aplicar_variacion.
+        """
+        libros = self.all() if libro_ids is None else self.filter(id__in=libro_ids)
+        disponibles = {'disponible': True, 'agotado': False}
+        # Un ejemplar individual cuenta como 1; un registro de stock agrupado, por sus unidades
+        unidades = Sum(Coalesce('unidades', Value(1)))
+        # Las respuestas cacheadas del catálogo dejan de valer cuando se confirme la transacción
+        transaction.on_commit(incrementar_version_catalogo)
+        return libros.update(
+            actualizado=timezone.now(),
+            ejemplares_disponibles=Coalesce(_subconsulta_ejemplares(unidades, **disponibles), Value(0)),
+            disponibles_nuevo=Coalesce(_subconsulta_ejemplares(unidades, estado='nuevo', **disponibles), Value(0)),
+            disponibles_usado=Coalesce(_subconsulta_ejemplares(unidades, estado='usado', **disponibles), Value(0)),
+            precio_min=_subconsulta_ejemplares(Min('precio')),
+            precio_max=_subconsulta_ejemplares(Max('precio')),
+        )
+
+    def aplicar_variacion(self, variaciones):
+        """
+        Suma a los contadores de disponibles las unidades de `variaciones` ({libro_id: {estado:
+        unidades}}, negativas al reclamar) con expresiones F, sin releer los ejemplares: así
+        reclamar y liberar no toman bloqueos sobre los demás ejemplares del libro. Los precios
+        no cambian al reclamar ni al liberar. Un UPDATE por libro, en orden de id.
+        Como en recalcular_resumen, un estado distinto de nuevo/usado solo cuenta en el total.
+        """
+        if not variaciones:
+            return
+        transaction.on_commit(incrementar_version_catalogo)
+        ahora = timezone.now()
+        for libro_id in sorted(variaciones):
+            por_estado = variaciones[libro_id]
+            campos = {'actualizado': ahora}
+            total = sum(por_estado.values())
+            if total:
+                campos['ejemplares_disponibles'] = _sumar_sin_negativos('ejemplares_disponibles', total)
+            for estado, unidades in por_estado.items():
+                if unidades and estado in self.ESTADOS_RESUMEN:
+                    campos[f'disponibles_{estado}'] = _sumar_sin_negativos(f'disponibles_{estado}', unidades)
+            self.filter(pk=libro_id).update(**campos)
+
+
 class Libro(models.Model):
     titulo = models.CharField(max_length=200)
     autor = models.CharField(max_length=100)
@@ -104,11 +211,151 @@ class Libro(models.Model):
     descripcion = models.TextField(blank=True)
     activo = models.BooleanField(default=True)
 
+    # Copias normalizadas (sin tildes, minúsculas) para filtrar el catálogo en la base de datos.
+    # La descomposición NFD puede alargar el texto, por eso el margen en max_length.
+    titulo_busqueda = models.CharField(max_length=600, blank=True, default='', editable=False, db_index=True)
+    autor_busqueda = models.CharField(max_length=300, blank=True, default='', editable=False, db_index=True)
+    genero_busqueda = models.CharField(max_length=300, blank=True, default='', editable=False, db_index=True)
+
+    # Resumen de ejemplares mantenido por LibroManager.recalcular_resumen y aplicar_variacion
+    # (precios sobre todos los ejemplares)
+    ejemplares_disponibles = models.PositiveIntegerField(default=0, editable=False, db_index=True)
+    disponibles_nuevo = models.PositiveIntegerField(default=0, editable=False)
+    disponibles_usado = models.PositiveIntegerField(default=0, editable=False)
+    precio_min = models.DecimalField(max_digits=10, decimal_places=2, null=True, editable=False, db_index=True)
+    precio_max = models.DecimalField(max_digits=10, decimal_places=2, null=True, editable=False, db_index=True)
+
+    # Sello de versión para ETag/Last-Modified: cambia al guardar el libro o al recalcular su resumen
+    actualizado = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = LibroManager()
+
+    def actualizar_campos_busqueda(self):
+        self.titulo_busqueda = texto_busqueda(self.titulo)
+        self.autor_busqueda = texto_busqueda(self.autor)
+        self.genero_busqueda = normalizar(self.genero)
+
+    CAMPOS_RESUMEN = ('ejemplares_disponibles', 'disponibles_nuevo', 'disponibles_usado', 'precio_min', 'precio_max')
+
+    def save(self, *args, **kwargs):
+        self.actualizar_campos_busqueda()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding:
+            # El resumen de ejemplares solo lo escribe recalcular_resumen; no pisarlo con valores en memoria
+            update_fields = [
+                campo.name for campo in self._meta.concrete_fields
+                if not campo.primary_key and campo.name not in self.CAMPOS_RESUMEN
+            ]
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'titulo_busqueda', 'autor_busqueda', 'genero_busqueda'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.titulo} - {self.autor}"
 
 
+class EjemplarNoDisponible(Exception):
+    pass
+
+
+class EjemplarQuerySet(models.QuerySet):
+    def reclamables(self):
+        return self.filter(disponible=True, agotado=False)
+
+    def reclamar(self, cantidad=1):
+        """
+        Reclama `cantidad` unidades de cada ejemplar del queryset con un UPDATE condicional
+        `... WHERE disponible AND NOT agotado` (y, en stock agrupado, `unidades >= cantidad`).
+        Un ejemplar individual pasa a no disponible; un registro de stock descuenta unidades y
+        deja de estar disponible al llegar a 0. Devuelve cuántas filas se reclamaron: las que
+        otro proceso ganó antes simplemente no cuentan.
+        """
+        suficientes = Q(unidades__gte=cantidad)
+        if cantidad == 1:
+            suficientes |= Q(unidades__isnull=True)
+        with transaction.atomic():
+            # Primero se bloquean las filas de ejemplar (por id) y después las de libro: el mismo
+            # orden en todos los que reclaman o liberan. El bloqueo fija además qué filas se
+            # reclaman, y con ellas cuánto descontar del resumen de cada libro.
+            filas = list(
+                self.reclamables().filter(suficientes).select_for_update().order_by('id')
+                .values_list('id', 'libro_id', 'estado')
+            )
+            if not filas:
+                return 0
+            # `disponible` va antes que `unidades`: MySQL evalúa las asignaciones de izquierda a
+            # derecha y la condición debe ver las unidades previas al descuento.
+            reclamados = Ejemplar.objects.filter(id__in=[fila[0] for fila in filas]).update(
+                disponible=Case(When(unidades__gt=cantidad, then=Value(True)), default=Value(False)),
+                unidades=F('unidades') - cantidad,
+            )
+            variaciones = defaultdict(Counter)
+            for _, libro_id, estado in filas:
+                variaciones[libro_id][estado] -= cantidad
+            Libro.objects.aplicar_variacion(variaciones)
+        return reclamados
+
+    def liberar(self, cantidad=1):
+        """Inverso de reclamar: devuelve las unidades al stock o vuelve a poner disponible el ejemplar."""
+        with transaction.atomic():
+            # Mismo orden de bloqueo que reclamar
+            filas = list(
+                self.filter(Q(unidades__isnull=False) | Q(disponible=False)).select_for_update().order_by('id')
+                .values_list('id', 'libro_id', 'estado', 'unidades', 'agotado')
+            )
+            if not filas:
+                return 0
+            liberados = Ejemplar.objects.filter(id__in=[fila[0] for fila in filas]).update(
+                disponible=True,
+                unidades=F('unidades') + cantidad,
+            )
+            variaciones = defaultdict(Counter)
+            for _, libro_id, estado, unidades, agotado in filas:
+                # Los agotados no cuentan como disponibles; un ejemplar individual vuelve como 1
+                if not agotado:
+                    variaciones[libro_id][estado] += 1 if unidades is None else cantidad
+            Libro.objects.aplicar_variacion(variaciones)
+        return liberados
+
+    def agregar_stock(self, libro, precio, cantidad):
+        """
+        Suma `cantidad` ejemplares nuevos al registro de stock agrupado del libro con ese precio,
+        o lo crea si no existe. Los ejemplares nuevos idénticos comparten así una sola fila.
+        """
+        with transaction.atomic():
+            # Bloquear el libro evita que dos altas simultáneas creen dos registros de stock
+            Libro.objects.select_for_update().filter(pk=libro.pk).exists()
+            stock = self.filter(
+                libro=libro, estado='nuevo', precio=precio, unidades__isnull=False, agotado=False
+            ).order_by('id').first()
+            if stock is None:
+                return self.create(libro=libro, estado='nuevo', precio=precio, unidades=cantidad)
+            self.filter(pk=stock.pk).update(disponible=True, unidades=F('unidades') + cantidad)
+            Libro.objects.recalcular_resumen([libro.pk])
+            stock.refresh_from_db()
+            return stock
+
+    def crear_en_lote(self, libro, cantidad, tamano_lote=500, **campos):
+        """
+        Crea `cantidad` ejemplares individuales del libro con bulk_create, en lotes de
+        `tamano_lote` filas y dentro de una sola transacción, y recalcula el resumen una vez.
+        Devuelve los ids creados, en orden.
+        """
+        ids = []
+        with transaction.atomic():
+            for inicio in range(0, cantidad, tamano_lote):
+                lote = [Ejemplar(libro=libro, **campos) for _ in range(min(tamano_lote, cantidad - inicio))]
+                self.bulk_create(lote)
+                if lote[0].pk is None:
+                    # Backends que no devuelven los ids del INSERT múltiple (MySQL): se leen por el código
+                    ids += self.filter(codigo__in=[e.codigo for e in lote]).order_by('id').values_list('id', flat=True)
+                else:
+                    ids += [e.pk for e in lote]
+            # bulk_create no pasa por Ejemplar.save
+            Libro.objects.recalcular_resumen([libro.pk])
+        return ids
+
+
 class Ejemplar(models.Model):
     libro = models.ForeignKey(Libro, on_delete=models.CASCADE, related_name="ejemplares")
     codigo = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
@@ -116,6 +363,68 @@ class Ejemplar(models.Model):
     precio = models.DecimalField(max_digits=10, decimal_places=2)
     disponible = models.BooleanField(default=True)
     agotado = models.BooleanField(default=False)
+    # None: ejemplar físico individual (p. ej. usado). Con valor: registro de stock agrupado de
+    # ejemplares nuevos idénticos al mismo precio, con las unidades que quedan.
+    unidades = models.PositiveIntegerField(null=True, blank=True)
+
+    objects = EjemplarQuerySet.as_manager()
+
+    @property
+    def es_stock_agrupado(self):
+        return self.unidades is not None
+
+    def es_reclamable(self, cantidad=1):
+        # Misma condición que EjemplarQuerySet.reclamar, sobre los valores en memoria
+        if not self.disponible or self.agotado:
+            return False
+        if self.es_stock_agrupado:
+            return self.unidades >= cantidad
+        return cantidad == 1
+
+    def liberar_reservas_vencidas(self):
+        """Expira las reservas vencidas que aún retienen este ejemplar. True si liberó alguna."""
+        if Reserva.objects.filter(ejemplar_id=self.pk).expirar():
+            self.refresh_from_db(fields=['disponible', 'unidades'])
+            return True
+        return False
+
+    def comprobar_disponibilidad(self, cantidad=1):
+        # Como es_reclamable, pero una reserva vencida que el barredor aún no procesó no cuenta
+        return self.es_reclamable(cantidad) or (self.liberar_reservas_vencidas() and self.es_reclamable(cantidad))
+
+    def reclamar(self, cantidad=1):
+        """Compare-and-set sobre la disponibilidad: True solo si esta llamada ganó las unidades."""
+        reclamado = Ejemplar.objects.filter(pk=self.pk).reclamar(cantidad) == 1
+        if not reclamado and self.liberar_reservas_vencidas():
+            reclamado = Ejemplar.objects.filter(pk=self.pk).reclamar(cantidad) == 1
+        if reclamado:
+            self.refresh_from_db(fields=['disponible', 'unidades'])
+        return reclamado
+
+    def liberar(self, cantidad=1):
+        liberado = Ejemplar.objects.filter(pk=self.pk).liberar(cantidad) == 1
+        if liberado:
+            self.refresh_from_db(fields=['disponible', 'unidades'])
+        return liberado
+
+    def save(self, *args, **kwargs):
+        # Guardar el ejemplar y el resumen de su libro en la misma transacción
+        existia = not self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            Libro.objects.recalcular_resumen([self.libro_id])
+            if existia:
+                # El precio pudo cambiar: los carritos que lo contienen guardan su total
+                Carrito.objects.recalcular_totales(CarritoItem.objects.filter(ejemplar_id=self.pk).values('carrito_id'))
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            carrito_ids = list(CarritoItem.objects.filter(ejemplar_id=self.pk).values_list('carrito_id', flat=True))
+            resultado = super().delete(*args, **kwargs)
+            Libro.objects.recalcular_resumen([self.libro_id])
+            if carrito_ids:
+                Carrito.objects.recalcular_totales(carrito_ids)
+        return resultado
 
     def __str__(self):
         return f"{self.codigo} - {self.libro.titulo} ({self.estado})"
@@ -147,11 +456,40 @@ class Direccion(models.Model):
         return f"{self.detalle}, {self.ciudad}, {self.pais} ({self.cliente.email})"
 
 
+def _subconsulta_items_carrito(agregado):
+    return Subquery(
+        CarritoItem.objects.filter(carrito=OuterRef('pk'))
+        .order_by()
+        .values('carrito')
+        .annotate(valor=agregado)
+        .values('valor')[:1]
+    )
+
+
+class CarritoManager(models.Manager):
+    def recalcular_totales(self, carrito_ids=None):
+        """Recalcula en un solo UPDATE las unidades y el total de los carritos indicados (o de todos)."""
+        carritos = self.all() if carrito_ids is None else self.filter(id__in=carrito_ids)
+        subtotal = Sum(F('cantidad') * F('ejemplar__precio'), output_field=models.DecimalField(max_digits=12, decimal_places=2))
+        return carritos.update(
+            actualizado=timezone.now(),
+            cantidad_items=Coalesce(_subconsulta_items_carrito(Sum('cantidad')), Value(0)),
+            total=Coalesce(_subconsulta_items_carrito(subtotal), Value(0), output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+        )
+
+
 class Carrito(models.Model):
     cliente = models.OneToOneField('Cliente', on_delete=models.CASCADE, related_name='carrito')
     creado = models.DateTimeField(auto_now_add=True)
     actualizado = models.DateTimeField(auto_now=True)
 
+    # Totales mantenidos por CarritoManager.recalcular_totales al agregar, quitar o comprar items,
+    # para mostrar el carrito (o su insignia) sin cargar los items
+    cantidad_items = models.PositiveIntegerField(default=0, editable=False)
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+
+    objects = CarritoManager()
+
     def __str__(self):
         return f"Carrito de {self.cliente.email}"
 
@@ -164,9 +502,48 @@ class CarritoItem(models.Model):
     def subtotal(self):
         return self.ejemplar.precio * self.cantidad
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            Carrito.objects.recalcular_totales([self.carrito_id])
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            resultado = super().delete(*args, **kwargs)
+            Carrito.objects.recalcular_totales([self.carrito_id])
+        return resultado
+
     def __str__(self):
         return f"{self.cantidad} x {self.ejemplar.libro.titulo} ({self.ejemplar.codigo})"
 
+class PedidoQuerySet(models.QuerySet):
+    # (estado actual, siguiente estado, segundos desde la creación del pedido)
+    TRANSICIONES = (
+        ('ENVIADO', 'ENTREGADO', 240),
+        ('EN PREPARACION', 'ENVIADO', 120),
+    )
+
+    def avanzar_estados(self, ahora=None):
+        """
+        Avanza los pedidos vencidos un estado con un UPDATE por transición, usando el índice
+        (estado, fecha_creacion) para tocar solo las filas que toca mover. ENVIADO → ENTREGADO
+        se aplica antes que EN PREPARACION → ENVIADO para que cada pedido avance como mucho un
+        estado por ejecución. Devuelve [(id, nuevo_estado), ...].
+        """
+        ahora = ahora or timezone.now()
+        actualizados = []
+        for estado, siguiente, segundos in self.TRANSICIONES:
+            with transaction.atomic():
+                vencidos = self.select_for_update(skip_locked=True).filter(
+                    estado=estado, fecha_creacion__lte=ahora - timedelta(seconds=segundos)
+                )
+                ids = list(vencidos.values_list('id', flat=True))
+                if ids:
+                    self.filter(id__in=ids, estado=estado).update(estado=siguiente)
+            actualizados += [(pedido_id, siguiente) for pedido_id in ids]
+        return actualizados
+
+
 class Pedido(models.Model):
     ESTADOS = [
         ('EN PREPARACION', 'En preparación'),
@@ -180,6 +557,14 @@ class Pedido(models.Model):
     total = models.DecimalField(max_digits=10, decimal_places=2)
     fecha_creacion = models.DateTimeField(default=timezone.now)  # ✅ Aquí está el campo
 
+    objects = PedidoQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['cliente', 'fecha_creacion'], name='pedido_cliente_fecha_idx'),
+            models.Index(fields=['estado', 'fecha_creacion'], name='pedido_estado_fecha_idx'),
+        ]
+
     def __str__(self):
         return f"Pedido #{self.id} - {self.cliente.email}"
 
@@ -189,6 +574,12 @@ class PedidoItem(models.Model):
     cantidad = models.PositiveIntegerField(default=1)
     precio_unitario = models.DecimalField(max_digits=10, decimal_places=2)
 
+    class Meta:
+        indexes = [
+            # Elegibilidad de devoluciones: items de un ejemplar y, por el pedido, su cliente y fecha
+            models.Index(fields=['ejemplar', 'pedido'], name='pedidoitem_ejemplar_pedido_idx'),
+        ]
+
     def subtotal(self):
         return self.cantidad * self.precio_unitario
 
@@ -196,6 +587,101 @@ class PedidoItem(models.Model):
         return f"{self.cantidad} x {self.ejemplar.libro.titulo if self.ejemplar else 'Desconocido'}"
 
 
+class LimiteReservasExcedido(Exception):
+    pass
+
+
+class ReservaQuerySet(models.QuerySet):
+    LOTE_EXPIRACION = 1000
+    MAX_RESERVAS_CLIENTE = 5
+    MAX_RESERVAS_POR_LIBRO = 3
+
+    # La validez de una reserva se evalúa contra fecha_expiracion al consultar: una reserva
+    # vencida deja de contar aunque el barredor todavía no la haya desactivado.
+    def vigentes(self, ahora=None):
+        return self.filter(activa=True, fecha_expiracion__gt=ahora or timezone.now())
+
+    def vencidas(self, ahora=None):
+        return self.filter(activa=True, fecha_expiracion__lte=ahora or timezone.now())
+
+    def no_vigentes(self, ahora=None):
+        return self.filter(Q(activa=False) | Q(fecha_expiracion__lte=ahora or timezone.now()))
+
+    def reservar(self, cliente, ejemplar_id):
+        """
+        Crea una reserva del ejemplar para el cliente en una transacción: bloquea la fila del
+        cliente (serializa sus reservas concurrentes, algo que bloquear sus reservas existentes no
+        logra porque no impide insertar nuevas), comprueba ambos cupos con un único agregado
+        condicional, reclama el ejemplar con un UPDATE condicional y guarda la reserva.
+        Lanza LimiteReservasExcedido o EjemplarNoDisponible.
+        """
+        with transaction.atomic():
+            Cliente.objects.select_for_update().filter(pk=cliente.pk).exists()
+
+            libro_id = Ejemplar.objects.filter(pk=ejemplar_id).values('libro_id')
+            cupos = self.vigentes().filter(cliente=cliente).aggregate(
+                total=Count('id'),
+                mismo_libro=Count('id', filter=Q(ejemplar__libro_id=Subquery(libro_id))),
+            )
+            if cupos['total'] >= self.MAX_RESERVAS_CLIENTE:
+                raise LimiteReservasExcedido(
+                    f'Solo puedes tener máximo {self.MAX_RESERVAS_CLIENTE} libros reservados.'
+                )
+            if cupos['mismo_libro'] >= self.MAX_RESERVAS_POR_LIBRO:
+                raise LimiteReservasExcedido(
+                    f'No puedes reservar más de {self.MAX_RESERVAS_POR_LIBRO} ejemplares del mismo libro.'
+                )
+
+            ejemplar = Ejemplar.objects.filter(pk=ejemplar_id)
+            if not ejemplar.reclamar():
+                # Puede que solo lo retenga una reserva vencida que el barredor aún no procesó
+                if not (self.model.objects.filter(ejemplar_id=ejemplar_id).expirar() and ejemplar.reclamar()):
+                    raise EjemplarNoDisponible('Este ejemplar no está disponible.')
+
+            reserva = self.model(cliente=cliente, ejemplar_id=ejemplar_id)
+            reserva.save(reclamar_ejemplar=False)
+        return reserva
+
+    def expirar(self, ahora=None, lote=LOTE_EXPIRACION):
+        """
+        Desactiva hasta `lote` reservas vencidas y libera sus ejemplares en una transacción:
+        una consulta para los ids, un UPDATE para desactivarlas y uno para liberar los ejemplares
+        (uno por cada número distinto de reservas por ejemplar en stock agrupado). Las filas se
+        bloquean con SKIP LOCKED, así que varios barredores en paralelo se reparten el trabajo
+        sin liberar dos veces la misma reserva. Devuelve cuántas reservas expiró.
+        """
+        ahora = ahora or timezone.now()
+        with transaction.atomic():
+            vencidas = list(
+                self.vencidas(ahora)
+                .select_for_update(skip_locked=True)
+                .order_by('fecha_expiracion')
+                .values_list('id', 'ejemplar_id')[:lote]
+            )
+            if not vencidas:
+                return 0
+
+            self.filter(id__in=[reserva_id for reserva_id, _ in vencidas]).update(activa=False)
+
+            # Cada reserva retiene una unidad de su ejemplar
+            por_cantidad = defaultdict(list)
+            for ejemplar_id, cantidad in Counter(ejemplar_id for _, ejemplar_id in vencidas).items():
+                por_cantidad[cantidad].append(ejemplar_id)
+            for cantidad, ejemplar_ids in por_cantidad.items():
+                Ejemplar.objects.filter(id__in=ejemplar_ids).liberar(cantidad)
+        return len(vencidas)
+
+    def expirar_todas(self, ahora=None, lote=LOTE_EXPIRACION):
+        # Un lote por transacción, para no retener bloqueos sobre miles de filas a la vez
+        ahora = ahora or timezone.now()
+        total = 0
+        while True:
+            expiradas = self.expirar(ahora, lote)
+            total += expiradas
+            if expiradas < lote:
+                return total
+
+
 class Reserva(models.Model):
     cliente = models.ForeignKey('Cliente', on_delete=models.CASCADE, related_name='reservas_activas')
     ejemplar = models.ForeignKey('Ejemplar', on_delete=models.CASCADE, related_name='reservas')
@@ -203,21 +689,36 @@ class Reserva(models.Model):
     fecha_expiracion = models.DateTimeField()
     activa = models.BooleanField(default=True)
 
-    def save(self, *args, **kwargs):
+    objects = ReservaQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['activa', 'fecha_expiracion'], name='reserva_activa_expiracion_idx'),
+        ]
+
+    def save(self, *args, reclamar_ejemplar=True, **kwargs):
         # Si es nueva reserva, definir expiración a 24 horas
         if not self.id:
             self.fecha_expiracion = timezone.now() + timedelta(hours=24)
-            # Marcar el ejemplar como no disponible
-            self.ejemplar.disponible = False
-            self.ejemplar.save()
+        if not self.id and reclamar_ejemplar:
+            # Reclamar el ejemplar; si otro cliente lo ganó antes no se crea la reserva
+            with transaction.atomic():
+                if not self.ejemplar.reclamar():
+                    raise EjemplarNoDisponible('Este ejemplar no está disponible.')
+                super().save(*args, **kwargs)
+            return
         super().save(*args, **kwargs)
 
     def cancelar(self):
-        # Liberar el ejemplar y desactivar reserva
+        # Desactivar la reserva solo si seguía activa, y entonces liberar el ejemplar
+        with transaction.atomic():
+            if Reserva.objects.filter(pk=self.pk, activa=True).update(activa=False):
+                self.ejemplar.liberar()
         self.activa = False
-        self.ejemplar.disponible = True
-        self.ejemplar.save()
-        self.save()
+
+    @property
+    def vigente(self):
+        return self.activa and timezone.now() < self.fecha_expiracion
 
     def verificar_expiracion(self):
         if self.activa and timezone.now() >= self.fecha_expiracion:
@@ -239,31 +740,28 @@ class Devolucion(models.Model):
     causa = models.CharField(max_length=50, choices=CAUSAS)
     motivo_ampliado = models.TextField(blank=True)
     fecha_solicitud = models.DateTimeField(auto_now_add=True)
-    codigo_qr = models.ImageField(upload_to='qrs/', blank=True)
+    codigo_qr = models.ImageField(upload_to=ruta_subida_qr, blank=True)
+
+    QR_PENDIENTE = 'pendiente'
+    QR_LISTO = 'listo'
+    QR_ERROR = 'error'
+    ESTADOS_QR = [
+        (QR_PENDIENTE, 'Pendiente'),
+        (QR_LISTO, 'Listo'),
+        (QR_ERROR, 'Error'),
+    ]
+    estado_qr = models.CharField(max_length=10, choices=ESTADOS_QR, default=QR_PENDIENTE)
 
     def save(self, *args, **kwargs):
         creating = self.pk is None
+        if creating and self.codigo_qr:
+            self.estado_qr = self.QR_LISTO
         super().save(*args, **kwargs)
 
         if creating and not self.codigo_qr:
-            qr_content = (
-                f"Devolución #{self.id}\n"
-                f"Cliente: {self.cliente.email}\n"
-                f"Libro: {self.ejemplar.libro.titulo}\n"
-                f"Fecha: {self.fecha_solicitud.strftime('%Y-%m-%d %H:%M')}"
-            )
-            qr_image = qrcode.make(qr_content)
-
-            buffer = BytesIO()
-            qr_image.save(buffer)
-
-            # Asegura que el nombre de archivo no tenga saltos de línea o espacios
-            filename = f"qr_devolucion_{self.id}.png".replace('\n', '').replace('\r', '').strip()
-
-            file_content = ContentFile(buffer.getvalue())
-            self.codigo_qr.save(filename, file_content, save=False)
-
-            super().save(update_fields=["codigo_qr"])
+            # El QR se renderiza en la primera descarga, o en segundo plano con QR_PRERENDER (api/qr.py)
+            devolucion_id = self.pk
+            transaction.on_commit(lambda: encolar_qr(devolucion_id))
 
     def __str__(self):
         return f"Devolución de {self.ejemplar.libro.titulo} ({self.cliente.email})"
@@ -271,7 +769,7 @@ class Devolucion(models.Model):
 
 class Noticia(models.Model):
     libro = models.ForeignKey('Libro', on_delete=models.CASCADE, related_name='noticias')
-    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True, db_index=True)
 
     def __str__(self):
         return f"Noticia: {self.libro.titulo} ({self.fecha_creacion.strftime('%Y-%m-%d')})"
@@ -283,6 +781,12 @@ class Mensaje(models.Model):
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     es_admin = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['fecha_creacion'], name='mensaje_fecha_idx'),
+            models.Index(fields=['cliente', 'fecha_creacion'], name='mensaje_cliente_fecha_idx'),
+        ]
+
     def __str__(self):
         return f"Mensaje de {self.cliente.email}: {self.contenido[:30]}"
 
@@ -0,0 +1,34 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+# Límite duro del tamaño de página que puede pedir el cliente con ?page_size=
+MAX_PAGE_SIZE = 100
+
+
+class PaginacionPorPagina(PageNumberPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = MAX_PAGE_SIZE
+
+
+class PaginacionCursor(CursorPagination):
+    """
+    Paginación por cursor (keyset): cada página filtra a partir de la última clave vista,
+    así la página N cuesta lo mismo que la primera. El orden se fija por endpoint.
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = MAX_PAGE_SIZE
+
+    def __init__(self, ordering=('id',)):
+        self.ordering = ordering
+
+
+def usa_cursor(request):
+    # Los endpoints mantienen su respuesta de siempre salvo que se pida ?paginacion=cursor
+    return request.query_params.get('paginacion') == 'cursor'
+
+
+def paginar_con_cursor(request, queryset, ordering):
+    paginador = PaginacionCursor(ordering)
+    pagina = paginador.paginate_queryset(queryset, request)
+    return paginador, pagina
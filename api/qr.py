@@ -0,0 +1,144 @@
+import hashlib
+import hmac
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import qrcode
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connection
+from django.urls import reverse
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def contenido_qr(devolucion):
+    return contenido_qr_campos(
+        devolucion.id, devolucion.cliente.email, devolucion.ejemplar.libro.titulo, devolucion.fecha_solicitud
+    )
+
+
+def contenido_qr_campos(devolucion_id, email, titulo, fecha_solicitud):
+    return (
+        f"Devolución #{devolucion_id}\n"
+        f"Cliente: {email}\n"
+        f"Libro: {titulo}\n"
+        f"Fecha: {fecha_solicitud.strftime('%Y-%m-%d %H:%M')}"
+    )
+
+
+def huella_qr(contenido):
+    # HMAC y no un hash simple: la URL con la huella sirve el QR sin autenticación, así que no
+    # debe poder calcularse conociendo los datos de la devolución
+    return hmac.new(settings.SECRET_KEY.encode(), contenido.encode(), hashlib.sha256).hexdigest()[:32]
+
+
+DIRECTORIO_QR = 'qrs'
+
+
+def ruta_qr(huella):
+    # Dos niveles de subdirectorios por prefijo de la huella (256 × 256): ningún directorio
+    # crece sin límite y el nombre del archivo depende solo de su contenido
+    return f"{DIRECTORIO_QR}/{huella[:2]}/{huella[2:4]}/{huella}.png"
+
+
+def ruta_subida_qr(instancia, nombre):
+    # upload_to de Devolucion.codigo_qr para archivos asignados a mano: mismo reparto por prefijo
+    huella = hashlib.sha256(nombre.encode()).hexdigest()[:32]
+    extension = nombre.rsplit('.', 1)[-1].lower() if '.' in nombre else 'png'
+    return f"{DIRECTORIO_QR}/{huella[:2]}/{huella[2:4]}/{huella}.{extension}"
+
+
+def url_qr(request, devolucion_id, contenido):
+    ruta = reverse('qr_devolucion_png', kwargs={'devolucion_id': devolucion_id, 'huella': huella_qr(contenido)})
+    return request.build_absolute_uri(ruta) if request else ruta
+
+
+def renderizar_qr(contenido):
+    buffer = BytesIO()
+    qrcode.make(contenido).save(buffer)
+    return buffer.getvalue()
+
+
+def obtener_png(devolucion, contenido=None):
+    """
+    PNG del QR de la devolución. Se guarda bajo la huella de su contenido, así que solo se
+    renderiza la primera vez (o si cambian los datos que muestra); después se lee del almacenamiento.
+    """
+    from .models import Devolucion
+
+    contenido = contenido or contenido_qr(devolucion)
+    ruta = ruta_qr(huella_qr(contenido))
+    if default_storage.exists(ruta):
+        with default_storage.open(ruta) as archivo:
+            return archivo.read()
+
+    png = renderizar_qr(contenido)
+    guardado = default_storage.save(ruta, ContentFile(png))
+    if guardado != ruta:
+        # Otra petición lo guardó a la vez: el contenido es el mismo, sobra la copia renombrada
+        default_storage.delete(guardado)
+    Devolucion.objects.filter(pk=devolucion.pk).exclude(codigo_qr=ruta).update(
+        codigo_qr=ruta, estado_qr=Devolucion.QR_LISTO
+    )
+    return png
+
+
+def generar_qr(devolucion_id):
+    """Prerenderiza el QR de una devolución pendiente (ver QR_PRERENDER)."""
+    from .models import Devolucion
+
+    devolucion = (
+        Devolucion.objects.select_related('cliente', 'ejemplar__libro')
+        .filter(pk=devolucion_id, estado_qr=Devolucion.QR_PENDIENTE)
+        .first()
+    )
+    if devolucion is None:
+        return
+    try:
+        obtener_png(devolucion)
+    except Exception:
+        logger.exception("No se pudo generar el QR de la devolución %s", devolucion_id)
+        Devolucion.objects.filter(pk=devolucion_id, estado_qr=Devolucion.QR_PENDIENTE).update(
+            estado_qr=Devolucion.QR_ERROR
+        )
+
+
+def _generar_en_segundo_plano(devolucion_id):
+    # Los hilos del pool abren su propia conexión: cerrarla al terminar para no dejarla colgada
+    close_old_connections()
+    try:
+        generar_qr(devolucion_id)
+    except Exception:
+        logger.exception("Fallo inesperado generando el QR de la devolución %s", devolucion_id)
+    finally:
+        connection.close()
+
+
+def _obtener_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'QR_WORKERS', 2), thread_name_prefix='qr'
+            )
+        return _executor
+
+
+def encolar_qr(devolucion_id):
+    """
+    Con QR_PRERENDER genera el QR fuera de la petición (o en línea si QR_ASINCRONO está
+    desactivado). Sin él no hace nada: el QR se renderiza en la primera descarga.
+    """
+    if not getattr(settings, 'QR_PRERENDER', False):
+        return
+    if not getattr(settings, 'QR_ASINCRONO', True):
+        generar_qr(devolucion_id)
+        return
+    _obtener_executor().submit(_generar_en_segundo_plano, devolucion_id)
@@ -8,6 +8,8 @@ from .models import (
     PedidoItem, Pedido
 )
 from django.contrib.auth import get_user_model, authenticate
+from django.db.models import Prefetch
+from .qr import contenido_qr, url_qr
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_decode
 from django.utils.encoding import force_str
@@ -59,11 +61,16 @@ class EditarClienteSerializer(serializers.ModelSerializer):
         )
 
 class ClienteSerializer(serializers.ModelSerializer):
+    historial_compras = serializers.SerializerMethodField()
+
     class Meta:
         model = Cliente
         exclude = ('password', 'last_login', 'is_superuser', 'groups', 'user_permissions')
         read_only_fields = ('email', 'cc', 'fecha_nacimiento')
 
+    def get_historial_compras(self, obj):
+        return obj.historial_desde_pedidos()
+
 
 class AdministradorSerializer(serializers.ModelSerializer):
     class Meta:
@@ -160,6 +167,30 @@ class LoginSerializer(serializers.Serializer):
         data['user'] = user
         return data
 
+def prefetch_ejemplares_vigentes(libros):
+    """
+    Prepara un queryset de libros para LibroSerializer/LibroDetalleSerializer: trae en dos
+    consultas los ejemplares disponibles de todos los libros y el primer ejemplar de cada uno
+    (respaldo cuando no hay disponibles), sin importar cuántos libros haya.
+    """
+    return libros.prefetch_related(
+        Prefetch(
+            'ejemplares',
+            queryset=Ejemplar.objects.filter(disponible=True, agotado=False).order_by('id'),
+            to_attr='ejemplares_vigentes',
+        ),
+        Prefetch('ejemplares', queryset=Ejemplar.objects.order_by('id')[:1], to_attr='primer_ejemplar'),
+    )
+
+
+def _ejemplares_vigentes(libro):
+    if hasattr(libro, 'ejemplares_vigentes'):
+        return libro.ejemplares_vigentes
+    if not libro.ejemplares_disponibles:
+        return []
+    return list(libro.ejemplares.filter(disponible=True, agotado=False).order_by('id'))
+
+
 class LibroSerializer(serializers.ModelSerializer):
     ejemplares = serializers.SerializerMethodField()
 
@@ -173,10 +204,13 @@ class LibroSerializer(serializers.ModelSerializer):
         ]
 
     def get_ejemplares(self, obj):
-        disponibles = obj.ejemplares.filter(disponible=True, agotado=False)
-        if not disponibles.exists():
+        disponibles = _ejemplares_vigentes(obj)
+        if not disponibles:
             # Opción 1: devolver al menos uno aunque esté agotado
-            disponibles = obj.ejemplares.all()[:1]
+            if hasattr(obj, 'primer_ejemplar'):
+                disponibles = obj.primer_ejemplar
+            else:
+                disponibles = obj.ejemplares.order_by('id')[:1]
         return EjemplarSerializer(disponibles, many=True).data
 
 class EjemplarSerializer(serializers.ModelSerializer):
@@ -184,12 +218,13 @@ class EjemplarSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Ejemplar
-        fields = ['id', 'codigo', 'estado', 'precio', 'disponible', 'agotado', 'libro']
-        read_only_fields = ['id', 'codigo']
+        fields = ['id', 'codigo', 'estado', 'precio', 'disponible', 'agotado', 'unidades', 'libro']
+        read_only_fields = ['id', 'codigo', 'unidades']
 
     def get_libro(self, obj):
+        # Con prefetch_ejemplares_vigentes o select_related('libro') el libro ya está en memoria
         return {
-            "id": obj.libro.id,
+            "id": obj.libro_id,
             "titulo": obj.libro.titulo,
         }
 
@@ -206,8 +241,66 @@ class LibroDetalleSerializer(serializers.ModelSerializer):
         ]
 
     def get_ejemplares(self, obj):
-        disponibles = obj.ejemplares.filter(disponible=True, agotado=False)
-        return EjemplarSerializer(disponibles, many=True).data
+        return EjemplarSerializer(_ejemplares_vigentes(obj), many=True).data
+
+
+# Cantidad de ids de ejemplares comprables que se incluyen en el resumen de un libro
+TAMANO_MUESTRA_EJEMPLARES = 5
+
+
+def prefetch_muestra_ejemplares(libros):
+    """Prepara un queryset de libros para LibroResumenSerializer (una consulta para la muestra de todos)."""
+    return libros.prefetch_related(
+        Prefetch(
+            'ejemplares',
+            queryset=Ejemplar.objects.filter(disponible=True, agotado=False).order_by('id')[:TAMANO_MUESTRA_EJEMPLARES],
+            to_attr='muestra_ejemplares',
+        ),
+    )
+
+
+class LibroResumenSerializer(serializers.ModelSerializer):
+    """
+    Libro con un resumen de sus ejemplares en lugar de la lista completa: conteos por estado,
+    rango de precios y unos pocos ids comprables. Los conteos salen de las columnas de resumen
+    de Libro; la lista completa se pide paginada en libros/<id>/ejemplares/.
+    """
+    resumen_ejemplares = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Libro
+        fields = [
+            'id', 'titulo', 'autor', 'anio_publicacion', 'genero',
+            'numero_paginas', 'editorial', 'issn', 'idioma',
+            'fecha_publicacion', 'categoria', 'imagen', 'destacado', 'descripcion',
+            'resumen_ejemplares'
+        ]
+
+    def get_resumen_ejemplares(self, obj):
+        if hasattr(obj, 'muestra_ejemplares'):
+            muestra = [ejemplar.id for ejemplar in obj.muestra_ejemplares]
+        else:
+            muestra = list(
+                obj.ejemplares.filter(disponible=True, agotado=False)
+                .order_by('id').values_list('id', flat=True)[:TAMANO_MUESTRA_EJEMPLARES]
+            )
+        return {
+            'disponibles': obj.ejemplares_disponibles,
+            'por_estado': {
+                'nuevo': obj.disponibles_nuevo,
+                'usado': obj.disponibles_usado,
+            },
+            'precio_min': str(obj.precio_min) if obj.precio_min is not None else None,
+            'precio_max': str(obj.precio_max) if obj.precio_max is not None else None,
+            'muestra': muestra,
+        }
+
+
+class EjemplarBasicoSerializer(serializers.ModelSerializer):
+    # Sin el libro anidado: se usa bajo libros/<id>/ejemplares/, donde el libro ya es conocido
+    class Meta:
+        model = Ejemplar
+        fields = ['id', 'codigo', 'estado', 'precio', 'disponible', 'agotado', 'unidades']
 
 
 class MetodoPagoSerializer(serializers.ModelSerializer):
@@ -225,10 +318,13 @@ class DireccionSerializer(serializers.ModelSerializer):
 class ReservaSerializer(serializers.ModelSerializer):
     ejemplar = EjemplarSerializer(read_only=True)
     ejemplar_id = serializers.PrimaryKeyRelatedField(queryset=Ejemplar.objects.filter(disponible=True), source='ejemplar', write_only=True)
+    # `activa` es la columna, que el barredor pone en False con retraso; `vigente` es el estado
+    # al momento de la consulta (una reserva vencida ya no retiene el ejemplar)
+    vigente = serializers.BooleanField(read_only=True)
 
     class Meta:
         model = Reserva
-        fields = ['id', 'cliente', 'ejemplar', 'ejemplar_id', 'fecha_creacion', 'fecha_expiracion', 'activa']
+        fields = ['id', 'cliente', 'ejemplar', 'ejemplar_id', 'fecha_creacion', 'fecha_expiracion', 'activa', 'vigente']
         read_only_fields = ['id', 'cliente', 'fecha_creacion', 'fecha_expiracion', 'activa']
 
 
@@ -239,14 +335,12 @@ class DevolucionSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Devolucion
-        fields = ['id', 'cliente', 'ejemplar', 'ejemplar_id', 'causa', 'motivo_ampliado', 'fecha_solicitud', 'codigo_qr_url']
-        read_only_fields = ['id', 'cliente', 'fecha_solicitud', 'codigo_qr_url']
+        fields = ['id', 'cliente', 'ejemplar', 'ejemplar_id', 'causa', 'motivo_ampliado', 'fecha_solicitud', 'estado_qr', 'codigo_qr_url']
+        read_only_fields = ['id', 'cliente', 'fecha_solicitud', 'estado_qr', 'codigo_qr_url']
 
     def get_codigo_qr_url(self, obj):
-        request = self.context.get('request')
-        if obj.codigo_qr and hasattr(obj.codigo_qr, 'url') and request:
-            return request.build_absolute_uri(obj.codigo_qr.url)
-        return None
+        # URL con la huella del contenido: el QR se renderiza en la primera descarga (ver api/qr.py)
+        return url_qr(self.context.get('request'), obj.id, contenido_qr(obj))
 
 
 class NoticiaSerializer(serializers.ModelSerializer):
@@ -312,8 +406,8 @@ class CarritoSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Carrito
-        fields = ['id', 'cliente', 'creado', 'actualizado', 'items']
-        read_only_fields = ['id', 'cliente', 'creado', 'actualizado', 'items']
+        fields = ['id', 'cliente', 'creado', 'actualizado', 'cantidad_items', 'total', 'items']
+        read_only_fields = ['id', 'cliente', 'creado', 'actualizado', 'cantidad_items', 'total', 'items']
 
 class PedidoItemSerializer(serializers.ModelSerializer):
     ejemplar_id = serializers.IntegerField(source='ejemplar.id', read_only=True)
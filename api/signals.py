@@ -0,0 +1,35 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Libro, Noticia
+from .indice_busqueda import indice
+from .cache import incrementar_version_catalogo
+
+
+# ===========================
+#   ÍNDICE DE BÚSQUEDA
+# ===========================
+
+@receiver(post_save, sender=Libro)
+def actualizar_indice_libro(sender, instance, **kwargs):
+    transaction.on_commit(lambda: indice.actualizar(instance))
+
+
+@receiver(post_delete, sender=Libro)
+def quitar_libro_del_indice(sender, instance, **kwargs):
+    libro_id = instance.id
+    transaction.on_commit(lambda: indice.eliminar(libro_id))
+
+
+# ===========================
+#   VERSIÓN DEL CATÁLOGO
+# ===========================
+# Los cambios de Ejemplar llegan por Libro.objects.recalcular_resumen, que también incrementa la versión.
+
+@receiver(post_save, sender=Libro)
+@receiver(post_delete, sender=Libro)
+@receiver(post_save, sender=Noticia)
+@receiver(post_delete, sender=Noticia)
+def invalidar_cache_catalogo(sender, **kwargs):
+    transaction.on_commit(incrementar_version_catalogo)
@@ -1,3 +1,307 @@
-from django.test import TestCase
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.db.models import Count
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .models import (
+    Administrador, Cliente, Ejemplar, EjemplarNoDisponible, Libro, LimiteReservasExcedido, Reserva,
+    ReservaQuerySet, Usuario,
+)
+from .views import rangos_ids
+
+
+def crear_libros(cantidad, ejemplares_por_libro=3):
+    libros = []
+    for i in range(cantidad):
+        libro = Libro.objects.create(
+            titulo=f'Libro {i}', autor=f'Autor {i}', anio_publicacion=2000, genero='Novela',
+            numero_paginas=100, editorial='Editorial', issn='0000-0000', idioma='Español',
+            fecha_publicacion=date(2000, 1, 1), categoria='Ficción', destacado=True,
+        )
+        Ejemplar.objects.crear_en_lote(libro, ejemplares_por_libro, estado='usado', precio=10000)
+        libros.append(libro)
+    return libros
+
+
+class ConsultasListadosLibrosTests(TestCase):
+    """
+    Los listados de libros cargan los ejemplares con prefetch (prefetch_ejemplares_vigentes,
+    prefetch_muestra_ejemplares): el número de consultas no depende de cuántos libros devuelvan.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = Administrador.objects.create(
+            email='admin@example.com', nombre='Admin', apellido='Admin', direccion='-', genero='-'
+        )
+
+    def assertConsultasConstantes(self, esperadas, url, usuario=None):
+        libro = crear_libros(1)[0]
+        for libros_creados in (1, 20):
+            if usuario is not None:
+                # Como lo cargaría la autenticación: sin la relación `administrador` ya resuelta
+                self.client.force_authenticate(Usuario.objects.get(pk=usuario.pk))
+            # Sin caché de respuestas, para medir la vista y no el acierto
+            cache.clear()
+            with self.assertNumQueries(esperadas):
+                response = self.client.get(url.format(libro_id=libro.pk))
+            self.assertEqual(response.status_code, 200)
+            if libros_creados == 1:
+                crear_libros(19, ejemplares_por_libro=5)
+
+    def test_catalogo(self):
+        # Sello del catálogo, COUNT de la paginación, libros y muestra de ejemplares
+        self.assertConsultasConstantes(4, '/api/catalogo/')
+
+    def test_catalogo_completo(self):
+        # La muestra se cambia por ejemplares disponibles y primer ejemplar
+        self.assertConsultasConstantes(5, '/api/catalogo/?ejemplares=completo')
+
+    def test_libros_disponibles(self):
+        self.assertConsultasConstantes(3, '/api/libros/disponibles/')
+
+    def test_libros_disponibles_completo(self):
+        self.assertConsultasConstantes(4, '/api/libros/disponibles/?ejemplares=completo')
+
+    def test_listar_libros_admin(self):
+        # hasattr(request.user, 'administrador'), libros y muestra de ejemplares
+        self.assertConsultasConstantes(3, '/api/libros/admin/', self.admin)
+
+    def test_listar_libros_admin_completo(self):
+        self.assertConsultasConstantes(4, '/api/libros/admin/?ejemplares=completo', self.admin)
+
+    def test_obtener_libro(self):
+        # Sello del libro para el ETag, sello del catálogo para la caché, libro y muestra de ejemplares
+        self.assertConsultasConstantes(4, '/api/libros/{libro_id}/')
+
+    def test_obtener_libro_completo(self):
+        self.assertConsultasConstantes(5, '/api/libros/{libro_id}/?ejemplares=completo')
+
+    def test_resumen_por_defecto(self):
+        libro = crear_libros(1)[0]
+        for url in ('/api/catalogo/', f'/api/libros/{libro.pk}/'):
+            datos = self.client.get(url).data
+            datos = datos['results'][0] if 'results' in datos else datos
+            self.assertNotIn('ejemplares', datos)
+            self.assertEqual(datos['resumen_ejemplares']['disponibles'], 3)
+        datos = self.client.get('/api/catalogo/?ejemplares=completo').data['results'][0]
+        self.assertEqual(len(datos['ejemplares']), 3)
+
+
+class ResumenEjemplaresTests(TestCase):
+    def resumen(self, libro):
+        libro.refresh_from_db()
+        return libro.ejemplares_disponibles, libro.disponibles_nuevo, libro.disponibles_usado
+
+    def test_reclamar_y_liberar_ejemplar_sin_estado(self):
+        # Ejemplares antiguos o creados sin estado: solo cuentan en el total, como en recalcular_resumen
+        libro = crear_libros(1, ejemplares_por_libro=0)[0]
+        ejemplar = Ejemplar.objects.create(libro=libro, estado='', precio=10000)
+        Ejemplar.objects.create(libro=libro, estado='usado', precio=10000)
+        self.assertEqual(self.resumen(libro), (2, 0, 1))
+
+        self.assertTrue(ejemplar.reclamar())
+        self.assertEqual(self.resumen(libro), (1, 0, 1))
+        self.assertTrue(ejemplar.liberar())
+        self.assertEqual(self.resumen(libro), (2, 0, 1))
+
+        Libro.objects.recalcular_resumen([libro.pk])
+        self.assertEqual(self.resumen(libro), (2, 0, 1))
+
+    def test_barrer_reserva_vencida_de_ejemplar_sin_estado(self):
+        cliente = Cliente.objects.create(
+            email='cliente@example.com', nombre='Cliente', apellido='Cliente', cc='1',
+            fecha_nacimiento=date(1990, 1, 1), direccion='-', genero='-',
+        )
+        libro = crear_libros(1, ejemplares_por_libro=0)[0]
+        ejemplar = Ejemplar.objects.create(libro=libro, estado='', precio=10000)
+        reserva = Reserva.objects.create(cliente=cliente, ejemplar=ejemplar)
+        Reserva.objects.filter(pk=reserva.pk).update(fecha_expiracion=timezone.now() - timedelta(minutes=1))
+
+        self.assertEqual(Reserva.objects.expirar(), 1)
+
+        self.assertEqual(self.resumen(libro), (1, 0, 0))
+
+
+class AltaEjemplaresTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(Administrador.objects.create(
+            email='admin@example.com', nombre='Admin', apellido='Admin', direccion='-', genero='-'
+        ))
+
+    def crear_libro(self, **datos):
+        return self.client.post('/api/libros/crear/', {
+            'titulo': 'Libro', 'autor': 'Autor', 'anio_publicacion': 2000, 'genero': 'Novela',
+            'numero_paginas': 100, 'editorial': 'Editorial', 'issn': '0000-0000', 'idioma': 'Español',
+            'fecha_publicacion': '2000-01-01', 'categoria': 'Ficción', 'precio': 10000, **datos,
+        }, format='json')
+
+    def test_crear_libro_da_de_alta_ejemplares_nuevos(self):
+        response = self.crear_libro(cantidad_ejemplares=3, agrupar=False)
+
+        self.assertEqual(response.status_code, 201)
+        ids = list(Ejemplar.objects.filter(libro_id=response.data['id']).order_by('id').values_list('id', flat=True))
+        self.assertEqual(
+            response.data['ejemplares_creados'], {'cantidad': 3, 'rangos': [{'desde': ids[0], 'hasta': ids[-1]}]}
+        )
+        self.assertEqual(set(Ejemplar.objects.filter(id__in=ids).values_list('estado', flat=True)), {'nuevo'})
+
+    def test_rangos_con_huecos_entre_lotes(self):
+        self.assertEqual(
+            rangos_ids([4, 5, 6, 9, 10, 12]),
+            [{'desde': 4, 'hasta': 6}, {'desde': 9, 'hasta': 10}, {'desde': 12, 'hasta': 12}],
+        )
+
+    def test_estado_invalido(self):
+        self.assertEqual(self.crear_libro(estado='roto').status_code, 400)
+        libro = crear_libros(1, ejemplares_por_libro=0)[0]
+        response = self.client.post(f'/api/libros/{libro.pk}/agregar_ejemplar/', {'estado': ''}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(libro.ejemplares.exists())
+
+    def test_agregar_ejemplar_devuelve_los_rangos_creados(self):
+        libro = crear_libros(1, ejemplares_por_libro=0)[0]
+        response = self.client.post(
+            f'/api/libros/{libro.pk}/agregar_ejemplar/', {'estado': 'usado', 'cantidad': 2, 'precio': 5000}, format='json'
+        )
+
+        self.assertEqual(response.status_code, 201)
+        ids = list(libro.ejemplares.order_by('id').values_list('id', flat=True))
+        self.assertEqual(response.data['ejemplares_creados'], {'cantidad': 2, 'rangos': [{'desde': ids[0], 'hasta': ids[1]}]})
+
+
+class ReservasInactivasTests(TestCase):
+    def test_reserva_vencida_sin_barrer_no_es_vigente(self):
+        cliente = Cliente.objects.create(
+            email='cliente@example.com', nombre='Cliente', apellido='Cliente', cc='1',
+            fecha_nacimiento=date(1990, 1, 1), direccion='-', genero='-',
+        )
+        ejemplar = crear_libros(1, ejemplares_por_libro=1)[0].ejemplares.get()
+        reserva = Reserva.objects.create(cliente=cliente, ejemplar=ejemplar)
+        # Vencida pero todavía activa: el barredor aún no pasó
+        Reserva.objects.filter(pk=reserva.pk).update(fecha_expiracion=timezone.now() - timedelta(minutes=1))
+        client = APIClient()
+        client.force_authenticate(Usuario.objects.get(pk=cliente.pk))
+
+        response = client.get('/api/reservas/inactivas/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(r['id'], r['activa'], r['vigente']) for r in response.data], [(reserva.id, True, False)])
+        self.assertEqual(client.get('/api/reservas/activas/').data, [])
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ReclamosConcurrentesTests(TransactionTestCase):
+    """
+    Varios hilos, cada uno con su propia conexión, reclaman o reservan a la vez los mismos
+    ejemplares. Cada unidad la gana un solo hilo, no se exceden los cupos de reservas y ningún
+    intento termina en error de base de datos (bloqueos mutuos incluidos). Necesita bloqueos
+    de fila: no corre en SQLite.
+    """
+
+    HILOS = 8
+
+    def en_paralelo(self, reclamar, intentos):
+        # Cada hilo recorre `intentos` en su propio orden y llama a reclamar(intento, hilo);
+        # devuelve cuántas veces se ganó cada intento
+        ganados = Counter()
+        errores = []
+        lock = threading.Lock()
+        barrera = threading.Barrier(self.HILOS)
+
+        def trabajar(semilla):
+            orden = list(intentos)
+            random.Random(semilla).shuffle(orden)
+            try:
+                barrera.wait()
+                for intento in orden:
+                    try:
+                        ganado = reclamar(intento, semilla)
+                    except DatabaseError as error:
+                        with lock:
+                            errores.append(error)
+                    else:
+                        if ganado:
+                            with lock:
+                                ganados[intento] += 1
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=trabajar, args=(semilla,)) for semilla in range(self.HILOS)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(errores, [])
+        return ganados
+
+    def test_ejemplares_individuales(self):
+        libro = crear_libros(1, ejemplares_por_libro=60)[0]
+        ids = list(libro.ejemplares.values_list('id', flat=True))
+
+        ganados = self.en_paralelo(lambda ejemplar_id, _: Ejemplar(pk=ejemplar_id).reclamar(), ids)
+
+        self.assertEqual([ejemplar_id for ejemplar_id, veces in ganados.items() if veces > 1], [])
+        self.assertEqual(set(ganados), set(ids))
+        self.assertFalse(Ejemplar.objects.filter(libro=libro, disponible=True).exists())
+        libro.refresh_from_db()
+        self.assertEqual((libro.ejemplares_disponibles, libro.disponibles_usado), (0, 0))
+
+    def test_stock_agrupado(self):
+        libro = crear_libros(1, ejemplares_por_libro=0)[0]
+        stock = Ejemplar.objects.agregar_stock(libro, precio=10000, cantidad=50)
+
+        # 8 hilos × 10 intentos sobre 50 unidades: exactamente 50 reclamos ganados
+        ganados = self.en_paralelo(lambda *_: Ejemplar.objects.filter(pk=stock.pk).reclamar() == 1, range(10))
+
+        self.assertEqual(sum(ganados.values()), 50)
+        stock.refresh_from_db()
+        self.assertEqual((stock.unidades, stock.disponible), (0, False))
+        libro.refresh_from_db()
+        self.assertEqual((libro.ejemplares_disponibles, libro.disponibles_nuevo), (0, 0))
+
+    def test_reservas(self):
+        # Dos hilos por cliente, todos sobre los mismos 60 ejemplares de 3 libros
+        clientes = [
+            Cliente.objects.create(
+                email=f'cliente{i}@example.com', nombre='Cliente', apellido='Cliente', cc=str(i),
+                fecha_nacimiento=date(1990, 1, 1), direccion='-', genero='-',
+            )
+            for i in range(self.HILOS // 2)
+        ]
+        ids = [ejemplar.pk for libro in crear_libros(3, ejemplares_por_libro=20) for ejemplar in libro.ejemplares.all()]
+
+        def reservar(ejemplar_id, hilo):
+            try:
+                Reserva.objects.reservar(clientes[hilo // 2], ejemplar_id)
+            except (LimiteReservasExcedido, EjemplarNoDisponible):
+                return False
+            return True
+
+        inicio = time.perf_counter()
+        ganados = self.en_paralelo(reservar, ids)
+        duracion = time.perf_counter() - inicio
+        sys.stderr.write(f"\nReservas: {self.HILOS * len(ids) / duracion:.0f} solicitudes/s en {duracion:.2f} s\n")
+
+        reservas = Reserva.objects.filter(activa=True)
+        self.assertEqual([ejemplar_id for ejemplar_id, veces in ganados.items() if veces > 1], [])
+        self.assertFalse(reservas.values('ejemplar').annotate(n=Count('id')).filter(n__gt=1).exists())
+        self.assertFalse(
+            reservas.values('cliente').annotate(n=Count('id')).filter(n__gt=ReservaQuerySet.MAX_RESERVAS_CLIENTE).exists()
+        )
+        self.assertFalse(
+            reservas.values('cliente', 'ejemplar__libro').annotate(n=Count('id'))
+            .filter(n__gt=ReservaQuerySet.MAX_RESERVAS_POR_LIBRO).exists()
+        )
+        # Cada cliente llena su cupo: hay ejemplares de sobra
+        self.assertEqual(reservas.count(), len(clientes) * ReservaQuerySet.MAX_RESERVAS_CLIENTE)
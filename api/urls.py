@@ -2,12 +2,15 @@ from django.urls import path
 from .views import (
     crear_libro,
     obtener_libro,
+    listar_ejemplares_libro,
     actualizar_libro,
     eliminar_libro,
     listar_libros_admin,
     restaurar_libro,
     agregar_al_carrito,
     ver_carrito,
+    resumen_carrito,
+    carrito_en_lote,
     eliminar_item_carrito,
     comprar_carrito,
     crear_reserva,
@@ -20,6 +23,9 @@ from .views import (
     solicitar_devolucion,
     catalogo_view,
     listar_mis_devoluciones,
+    obtener_devolucion,
+    qr_devolucion,
+    qr_devolucion_png,
     agregar_ejemplar,
     libros_disponibles,
     agregar_metodo_pago,
@@ -47,7 +53,8 @@ from .views import (
     listar_mensajes,
     ver_mensaje_detalle,
     responder_mensaje,
-    avanzar_estado_pedidos
+    avanzar_estado_pedidos,
+    ver_estadisticas_cache,
 )
 
 from django.contrib.auth import views as auth_views
@@ -82,6 +89,7 @@ urlpatterns = [
     path('libros/<int:libro_id>/agregar_ejemplar/', agregar_ejemplar, name='agregar_ejemplar'),
     path('libros/disponibles/', libros_disponibles, name='libros_disponibles'),
     path('libros/<int:libro_id>/', obtener_libro, name='obtener_libro'),
+    path('libros/<int:libro_id>/ejemplares/', listar_ejemplares_libro, name='listar_ejemplares_libro'),
     path('libros/<int:libro_id>/editar/', actualizar_libro, name='actualizar_libro'),
     path('libros/<int:libro_id>/eliminar/', eliminar_libro, name='eliminar_libro'),
     path("libros/admin/", listar_libros_admin, name="listar_libros_admin"),
@@ -106,6 +114,8 @@ urlpatterns = [
     # CARRITO DE COMPRAS
     path('carrito/agregar/', agregar_al_carrito, name='agregar_al_carrito'),
     path('carrito/', ver_carrito, name='ver_carrito'),
+    path('carrito/resumen/', resumen_carrito, name='resumen_carrito'),
+    path('carrito/lote/', carrito_en_lote, name='carrito_en_lote'),
     path('carrito/item/<int:item_id>/eliminar/', eliminar_item_carrito, name='eliminar_item_carrito'),
     path('carrito/comprar/', comprar_carrito, name='comprar_carrito'),
 
@@ -123,6 +133,9 @@ urlpatterns = [
     # DEVOLUCIONES
     path('devoluciones/solicitar/', solicitar_devolucion, name='solicitar_devolucion'),
     path('devoluciones/mis/', listar_mis_devoluciones, name='listar_mis_devoluciones'),
+    path('devoluciones/<int:devolucion_id>/', obtener_devolucion, name='obtener_devolucion'),
+    path('devoluciones/<int:devolucion_id>/qr/', qr_devolucion, name='qr_devolucion'),
+    path('devoluciones/<int:devolucion_id>/qr/<str:huella>.png', qr_devolucion_png, name='qr_devolucion_png'),
 
     # NOTICIAS
     path('noticias/', listar_noticias, name='listar_noticias'),
@@ -136,4 +149,5 @@ urlpatterns = [
 
     path('catalogo/', catalogo_view, name='catalogo'),
     path('pedidos/avanzar-estado/', avanzar_estado_pedidos, name='avanzar_estado_pedidos'),
+    path('cache/estadisticas/', ver_estadisticas_cache, name='ver_estadisticas_cache'),
 ]
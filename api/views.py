@@ -3,7 +3,6 @@ from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
 from django.contrib.auth import get_user_model
 
 
@@ -12,7 +11,14 @@ from django.utils.encoding import force_bytes, force_str
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.contrib.auth import get_user_model, authenticate
 from django.contrib.auth.hashers import make_password
-import unicodedata
+from django.conf import settings
+from django.views.decorators.http import condition, require_GET
+from django.http import Http404, HttpResponse
+from django.shortcuts import redirect
+import hmac
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch, Subquery
 
 from .models import (
     Cliente, Administrador, Root, 
@@ -20,9 +26,17 @@ from .models import (
     Carrito, CarritoItem, Ejemplar, 
     Reserva, Devolucion, Noticia,
     Mensaje, RespuestaMensaje, Pedido, 
-    PedidoItem
+    PedidoItem, EjemplarNoDisponible, LimiteReservasExcedido
 )
 from django.utils import timezone
+from .busqueda import normalizar  # noqa: F401 (api.views.normalizar sigue disponible)
+from .catalogo import filtrar_catalogo, facetas_catalogo
+from .pagination import PaginacionPorPagina, usa_cursor, paginar_con_cursor
+from .cache import respuesta_cacheada, estadisticas_cache
+from .compras import procesar_compra, CompraEnConflicto
+from .carrito import agregar_en_lote, quitar_en_lote
+from .condicional import etag_libro, ultima_modificacion_libro, etag_catalogo, ultima_modificacion_catalogo_request, etag_qr
+from .qr import contenido_qr, contenido_qr_campos, huella_qr, obtener_png, url_qr
 from .serializers import (
     RegistroClienteSerializer,
     ClienteSerializer,
@@ -37,6 +51,10 @@ from .serializers import (
     LibroSerializer,
     EjemplarSerializer,
     LibroDetalleSerializer,
+    prefetch_ejemplares_vigentes,
+    LibroResumenSerializer,
+    prefetch_muestra_ejemplares,
+    EjemplarBasicoSerializer,
     MetodoPagoSerializer,
     DireccionSerializer,
     CarritoSerializer,
@@ -163,34 +181,50 @@ def listar_mis_pedidos(request):
     except Cliente.DoesNotExist:
         return Response({'error': 'Solo los clientes pueden ver sus pedidos.'}, status=403)
 
-    pedidos = Pedido.objects.filter(cliente=cliente).order_by('fecha_creacion')
+    # Una consulta para los pedidos y otra para todos sus items con ejemplar, libro y devolución
+    devoluciones = Devolucion.objects.filter(cliente=cliente, ejemplar=OuterRef('ejemplar')).order_by('id')
+    items = (
+        PedidoItem.objects.select_related('ejemplar__libro')
+        .annotate(
+            devuelto=Exists(devoluciones),
+            devolucion_id=Subquery(devoluciones.values('id')[:1]),
+            fecha_devolucion=Subquery(devoluciones.values('fecha_solicitud')[:1]),
+        )
+        .order_by('id')
+    )
+    pedidos = (
+        Pedido.objects.filter(cliente=cliente)
+        .prefetch_related(Prefetch('items', queryset=items))
+        .order_by('fecha_creacion', 'id')
+    )
+
+    paginador = None
+    if usa_cursor(request):
+        paginador, pedidos = paginar_con_cursor(request, pedidos, ('fecha_creacion', 'id'))
 
     data = []
 
     for pedido in pedidos:
         resumen = []
-        items = PedidoItem.objects.filter(pedido=pedido)
 
-        for item in items:
+        for item in pedido.items.all():
             ejemplar = item.ejemplar
-            libro = ejemplar.libro
+            libro = ejemplar.libro if ejemplar else None
 
-            devolucion = Devolucion.objects.filter(cliente=cliente, ejemplar=ejemplar).first()
             codigo_qr_url = None
-
-            if devolucion:
-                serializer = DevolucionSerializer(devolucion, context={'request': request})
-                codigo_qr_url = serializer.data.get('codigo_qr_url')
+            if item.devolucion_id and libro:
+                contenido = contenido_qr_campos(item.devolucion_id, cliente.email, libro.titulo, item.fecha_devolucion)
+                codigo_qr_url = url_qr(request, item.devolucion_id, contenido)
 
             resumen.append({
-                "ejemplar_id": ejemplar.id,
-                "titulo": libro.titulo,
-                "autor": libro.autor,
+                "ejemplar_id": ejemplar.id if ejemplar else None,
+                "titulo": libro.titulo if libro else 'Desconocido',
+                "autor": libro.autor if libro else 'Desconocido',
                 "cantidad": item.cantidad,
                 "precio_unitario": item.precio_unitario,
                 "subtotal": item.cantidad * item.precio_unitario,
-                "estado_ejemplar": ejemplar.estado,
-                "devuelto": bool(devolucion),
+                "estado_ejemplar": ejemplar.estado if ejemplar else 'Desconocido',
+                "devuelto": item.devuelto,
                 "codigo_qr": codigo_qr_url
             })
 
@@ -201,7 +235,9 @@ def listar_mis_pedidos(request):
             'total': pedido.total,
             'resumen': resumen
         })
-    print("QR URL para ejemplar", ejemplar.id, "→", codigo_qr_url)
+
+    if paginador:
+        return paginador.get_paginated_response(data)
     return Response(data)
 
 @api_view(['POST'])
@@ -233,107 +269,113 @@ def confirm_password_reset(request):
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-def normalizar(texto):
-    if not texto:
-        return ""
-    texto = unicodedata.normalize('NFD', texto)
-    texto = ''.join(c for c in texto if unicodedata.category(c) != 'Mn')  # elimina tildes
-    return texto.lower().strip()
+def usa_resumen_ejemplares(request):
+    # Por defecto cada libro trae un resumen de sus ejemplares (conteos, precios y una muestra de ids);
+    # ?ejemplares=completo embebe todos los disponibles. La lista paginada está en libros/<id>/ejemplares/.
+    return request.GET.get('ejemplares') != 'completo'
+
 
+@condition(etag_func=etag_catalogo, last_modified_func=ultima_modificacion_catalogo_request)
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@respuesta_cacheada('catalogo')
 def catalogo_view(request):
-    from rest_framework.pagination import PageNumberPagination
-    import unicodedata
-
-    genero = request.GET.get('genero')
-    palabra = request.GET.get('q', "")
-    titulo = request.GET.get('titulo', "")
-    autor = request.GET.get('autor', "")
-    precio_min = request.GET.get('precio_min')
-    precio_max = request.GET.get('precio_max')
-    destacado = request.GET.get('destacado')
-
-    def normalizar(texto):
-        if not texto:
-            return ""
-        texto = unicodedata.normalize('NFD', texto)
-        texto = ''.join(c for c in texto if unicodedata.category(c) != 'Mn')
-        return texto.lower().strip()
-
-    def contiene(texto, subtexto):
-        texto_normalizado = normalizar(texto)
-        subtexto_normalizado = normalizar(subtexto)
-
-        # Dividimos en palabras y verificamos si alguna empieza por el subtexto
-        return any(palabra.startswith(subtexto_normalizado) for palabra in texto_normalizado.split())
-
-    libros = Libro.objects.filter(activo=True).prefetch_related('ejemplares').order_by('id')
-    libros = [libro for libro in libros if libro.ejemplares.filter(disponible=True, agotado=False).exists()]
-
-    # Filtro por género
-    if genero:
-        genero_normalizado = normalizar(genero)
-        libros = [libro for libro in libros if normalizar(libro.genero) == genero_normalizado]
-
-    # Filtro por palabra general q (titulo o autor)
-    if palabra:
-        libros = [libro for libro in libros if contiene(libro.titulo, palabra) or contiene(libro.autor, palabra)]
-
-    # Filtro por autor y/o título específicos
-    if autor and titulo:
-        libros = [libro for libro in libros if contiene(libro.titulo, titulo) and contiene(libro.autor, autor)]
-    elif autor:
-        libros = [libro for libro in libros if contiene(libro.autor, autor)]
-    elif titulo:
-        libros = [libro for libro in libros if contiene(libro.titulo, titulo)]
-
-    # Filtros por precio
-    if precio_min:
-        try:
-            precio_min = float(precio_min)
-            libros = [libro for libro in libros if any(ej.precio >= precio_min for ej in libro.ejemplares.all())]
-        except ValueError:
-            pass
-
-    if precio_max:
-        try:
-            precio_max = float(precio_max)
-            libros = [libro for libro in libros if any(ej.precio <= precio_max for ej in libro.ejemplares.all())]
-        except ValueError:
-            pass
-
-    # Filtro por destacados
-    if destacado is not None:
-        if destacado.lower() in ['true', '1']:
-            libros = [libro for libro in libros if libro.destacado]
-        elif destacado.lower() in ['false', '0']:
-            libros = [libro for libro in libros if not libro.destacado]
-
-    paginator = PageNumberPagination()
-    paginator.page_size = int(request.GET.get('page_size', 10))
-    result_page = paginator.paginate_queryset(libros, request)
-
-    serializer = LibroSerializer(result_page, many=True)
-    return paginator.get_paginated_response(serializer.data)
+    libros = filtrar_catalogo(request.GET)
+    resumen = usa_resumen_ejemplares(request)
+    if resumen:
+        libros = prefetch_muestra_ejemplares(libros).order_by('id')
+    else:
+        libros = prefetch_ejemplares_vigentes(libros).order_by('id')
+
+    if usa_cursor(request):
+        paginator, result_page = paginar_con_cursor(request, libros, ('id',))
+    else:
+        paginator = PaginacionPorPagina()
+        result_page = paginator.paginate_queryset(libros, request)
+
+    serializer = (LibroResumenSerializer if resumen else LibroSerializer)(result_page, many=True)
+    response = paginator.get_paginated_response(serializer.data)
+
+    if request.GET.get('facetas', '').lower() in ['true', '1']:
+        response.data['facetas'] = facetas_catalogo(request, libros)
+    return response
+
+
+def agrupar_stock(request):
+    # ?agrupar=true|false decide si los ejemplares nuevos se dan de alta como un registro de stock con unidades
+    valor = request.query_params.get('agrupar', request.data.get('agrupar'))
+    if valor is None:
+        return getattr(settings, 'STOCK_NUEVO_AGRUPADO', False)
+    return str(valor).lower() in ['true', '1']
+
+
+def leer_cantidad_ejemplares(valor):
+    """Devuelve (cantidad, error): la cantidad pedida si es un entero entre 1 y MAX_EJEMPLARES_POR_SOLICITUD."""
+    maximo = getattr(settings, 'MAX_EJEMPLARES_POR_SOLICITUD', 1000)
+    try:
+        cantidad = int(valor)
+    except (TypeError, ValueError):
+        return None, 'La cantidad debe ser un número entero.'
+    if cantidad < 1 or cantidad > maximo:
+        return None, f'La cantidad debe estar entre 1 y {maximo}.'
+    return cantidad, None
+
+
+def leer_estado_ejemplar(valor):
+    """Devuelve (estado, error): el estado pedido si es uno de los de Ejemplar (por defecto 'nuevo')."""
+    estados = [estado for estado, _ in Ejemplar._meta.get_field('estado').choices]
+    estado = 'nuevo' if valor is None else valor
+    if estado not in estados:
+        return None, f"El estado debe ser uno de: {', '.join(estados)}."
+    return estado, None
+
+
+def rangos_ids(ids):
+    # Ids creados como rangos consecutivos: otros INSERT entre lotes pueden dejar huecos
+    rangos = []
+    for ejemplar_id in ids:
+        if rangos and rangos[-1]['hasta'] == ejemplar_id - 1:
+            rangos[-1]['hasta'] = ejemplar_id
+        else:
+            rangos.append({'desde': ejemplar_id, 'hasta': ejemplar_id})
+    return rangos
+
+
+def crear_ejemplares(libro, cantidad, **campos):
+    # Un INSERT múltiple por lote en lugar de un INSERT (y un recálculo del resumen) por ejemplar
+    ids = Ejemplar.objects.crear_en_lote(
+        libro, cantidad, tamano_lote=getattr(settings, 'TAMANO_LOTE_EJEMPLARES', 500), **campos
+    )
+    return {'cantidad': len(ids), 'rangos': rangos_ids(ids)}
+
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def crear_libro(request):
+    cantidad, error = leer_cantidad_ejemplares(request.data.get('cantidad_ejemplares', 1))
+    if error:
+        return Response({'error': error}, status=400)
+    estado, error = leer_estado_ejemplar(request.data.get('estado'))
+    if error:
+        return Response({'error': error}, status=400)
+
     serializer = LibroSerializer(data=request.data)
     if serializer.is_valid():
-        libro = serializer.save()
-        cantidad = int(request.data.get('cantidad_ejemplares', 1))
         precio = float(request.data.get('precio', 0))
 
-        for _ in range(cantidad):
-            Ejemplar.objects.create(
-                libro=libro,
-                precio=precio,
-                disponible=True,
-                agotado=False
-            )
-        return Response(LibroSerializer(libro).data, status=201)
+        with transaction.atomic():
+            libro = serializer.save()
+            if estado == 'nuevo' and agrupar_stock(request):
+                stock = Ejemplar.objects.agregar_stock(libro, precio, cantidad)
+                creados = {'cantidad': cantidad, 'rangos': rangos_ids([stock.id])}
+            else:
+                creados = crear_ejemplares(
+                    libro, cantidad, precio=precio, estado=estado, disponible=True, agotado=False
+                )
+        libro.refresh_from_db()
+        data = LibroSerializer(libro).data
+        data['ejemplares_creados'] = creados
+        return Response(data, status=201)
     return Response(serializer.errors, status=400)
 
 
@@ -346,32 +388,59 @@ def agregar_ejemplar(request, libro_id):
     except Libro.DoesNotExist:
         return Response({'error': 'Libro no encontrado'}, status=404)
 
-    cantidad = int(request.data.get('cantidad', 1))
+    cantidad, error = leer_cantidad_ejemplares(request.data.get('cantidad', 1))
+    if error:
+        return Response({'error': error}, status=400)
+    estado, error = leer_estado_ejemplar(request.data.get('estado'))
+    if error:
+        return Response({'error': error}, status=400)
     precio = float(request.data.get('precio', 0))
 
-    for _ in range(cantidad):
-        Ejemplar.objects.create(
-            libro=libro,
-            precio=precio,
-            estado=request.data.get("estado", "nuevo"),
-            disponible=request.data.get("disponible", True),
-            agotado=request.data.get("agotado", False)
-        )
-    return Response({'message': f'Se agregaron {cantidad} ejemplares'}, status=201)
+    if estado == 'nuevo' and agrupar_stock(request):
+        stock = Ejemplar.objects.agregar_stock(libro, precio, cantidad)
+        return Response({'message': f'Se agregaron {cantidad} ejemplares', 'ejemplar_id': stock.id,
+                         'unidades': stock.unidades}, status=201)
+
+    creados = crear_ejemplares(
+        libro,
+        cantidad,
+        precio=precio,
+        estado=estado,
+        disponible=request.data.get("disponible", True),
+        agotado=request.data.get("agotado", False)
+    )
+    return Response({'message': f'Se agregaron {cantidad} ejemplares', 'ejemplares_creados': creados}, status=201)
 
 
+@condition(etag_func=etag_libro, last_modified_func=ultima_modificacion_libro)
 @api_view(['GET'])
 @permission_classes([AllowAny])  # o IsAuthenticated si quieres restringir
+@respuesta_cacheada('libro')
 def obtener_libro(request, libro_id):
+    resumen = usa_resumen_ejemplares(request)
+    libros = prefetch_muestra_ejemplares(Libro.objects) if resumen else prefetch_ejemplares_vigentes(Libro.objects)
     try:
-        libro = Libro.objects.prefetch_related('ejemplares').get(id=libro_id, activo=True)
+        libro = libros.get(id=libro_id, activo=True)
     except Libro.DoesNotExist:
         return Response({'error': 'Libro no encontrado.'}, status=status.HTTP_404_NOT_FOUND)
 
-    serializer = LibroDetalleSerializer(libro)
+    serializer = LibroResumenSerializer(libro) if resumen else LibroDetalleSerializer(libro)
     return Response(serializer.data)
 
 
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@respuesta_cacheada('ejemplares_libro')
+def listar_ejemplares_libro(request, libro_id):
+    # Lista completa de ejemplares disponibles de un libro, paginada por cursor
+    if not Libro.objects.filter(id=libro_id, activo=True).exists():
+        return Response({'error': 'Libro no encontrado.'}, status=status.HTTP_404_NOT_FOUND)
+
+    ejemplares = Ejemplar.objects.filter(libro_id=libro_id, disponible=True, agotado=False)
+    paginador, pagina = paginar_con_cursor(request, ejemplares, ('id',))
+    return paginador.get_paginated_response(EjemplarBasicoSerializer(pagina, many=True).data)
+
+
 
 @api_view(['PUT'])
 @permission_classes([IsAuthenticated])
@@ -411,6 +480,7 @@ def eliminar_libro(request, libro_id):
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@respuesta_cacheada('libros_disponibles')
 def libros_disponibles(request):
     categoria = request.GET.get('categoria')
     
@@ -419,10 +489,12 @@ def libros_disponibles(request):
     if categoria:
         libros = libros.filter(categoria__icontains=categoria.strip())
 
-    libros = libros.distinct()
-    libros = [libro for libro in libros if libro.ejemplares.filter(disponible=True, agotado=False).exists()]
+    libros = libros.filter(ejemplares_disponibles__gt=0).distinct()
 
-    serializer = LibroSerializer(libros, many=True)
+    if usa_resumen_ejemplares(request):
+        serializer = LibroResumenSerializer(prefetch_muestra_ejemplares(libros), many=True)
+    else:
+        serializer = LibroSerializer(prefetch_ejemplares_vigentes(libros), many=True)
     return Response(serializer.data)
 
 
@@ -496,8 +568,18 @@ def listar_libros_admin(request):
         elif activo.lower() in ['false', '0']:
             libros = libros.filter(activo=False)
 
-    libros = libros.prefetch_related('ejemplares')
-    serializer = LibroDetalleSerializer(libros, many=True)
+    if usa_resumen_ejemplares(request):
+        libros = prefetch_muestra_ejemplares(libros).order_by('id')
+        serializador = LibroResumenSerializer
+    else:
+        libros = prefetch_ejemplares_vigentes(libros).order_by('id')
+        serializador = LibroDetalleSerializer
+
+    if usa_cursor(request):
+        paginador, pagina = paginar_con_cursor(request, libros, ('id',))
+        return paginador.get_paginated_response(serializador(pagina, many=True).data)
+
+    serializer = serializador(libros, many=True)
     return Response(serializer.data)
 
 
@@ -598,8 +680,11 @@ def agregar_al_carrito(request):
     if serializer.is_valid():
         ejemplar = serializer.validated_data['ejemplar']
 
-        # Validar que el ejemplar esté disponible
-        if not ejemplar.disponible or ejemplar.agotado:
+        cantidad = serializer.validated_data.get('cantidad', 1)
+
+        # Validar que el ejemplar esté disponible (el ejemplar se reclama al comprar).
+        # Solo el stock agrupado admite más de una unidad por item.
+        if not ejemplar.comprobar_disponibilidad(cantidad):
             return Response({'error': 'Este ejemplar no está disponible.'}, status=status.HTTP_400_BAD_REQUEST)
 
         # Verificar que no esté ya agregado
@@ -609,26 +694,82 @@ def agregar_al_carrito(request):
         CarritoItem.objects.create(
             carrito=carrito,
             ejemplar=ejemplar,
-            cantidad=serializer.validated_data.get('cantidad', 1)
+            cantidad=cantidad
         )
         return Response({'message': 'Ejemplar agregado al carrito.'}, status=status.HTTP_201_CREATED)
 
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-@api_view(['GET'])
+@api_view(['POST'])
 @permission_classes([IsAuthenticated])
-def ver_carrito(request):
+def carrito_en_lote(request):
+    """
+    Agrega y quita varios items en una petición:
+    {"agregar": [{"ejemplar_id": 1, "cantidad": 1}, ...], "quitar": [item_id, ...]}
+    Responde un resultado por elemento y los totales del carrito.
+    """
     try:
         cliente = Cliente.objects.get(id=request.user.id)
-        carrito = cliente.carrito
-    except (Cliente.DoesNotExist, Carrito.DoesNotExist):
+    except Cliente.DoesNotExist:
+        return Response({'error': 'Solo los clientes pueden agregar al carrito.'}, status=status.HTTP_403_FORBIDDEN)
+
+    agregar = request.data.get('agregar') or []
+    quitar = request.data.get('quitar') or []
+    maximo = getattr(settings, 'MAX_ITEMS_POR_LOTE_CARRITO', 100)
+    if not isinstance(agregar, list) or not isinstance(quitar, list):
+        return Response({'error': '"agregar" y "quitar" deben ser listas.'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(agregar) + len(quitar) > maximo:
+        return Response({'error': f'Máximo {maximo} elementos por petición.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        solicitados = [
+            (int(elemento['ejemplar_id']), int(elemento.get('cantidad', 1)))
+            for elemento in agregar
+        ]
+        item_ids = [int(item_id) for item_id in quitar]
+    except (TypeError, ValueError, KeyError, AttributeError):
+        return Response({'error': 'Cada elemento de "agregar" necesita un ejemplar_id (y opcionalmente cantidad) '
+                                  'y "quitar" debe contener ids de items.'}, status=status.HTTP_400_BAD_REQUEST)
+    if any(cantidad < 1 for _, cantidad in solicitados):
+        return Response({'error': 'La cantidad debe ser al menos 1.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    carrito, created = Carrito.objects.get_or_create(cliente=cliente)
+    resultados = {
+        'quitar': quitar_en_lote(carrito, item_ids) if item_ids else [],
+        'agregar': agregar_en_lote(carrito, solicitados) if solicitados else [],
+    }
+    cantidad_items, total = Carrito.objects.filter(pk=carrito.pk).values_list('cantidad_items', 'total').get()
+    return Response({'resultados': resultados, 'cantidad_items': cantidad_items, 'total': str(total)})
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def ver_carrito(request):
+    # Una consulta para el carrito (con sus totales) y otra, con JOIN a ejemplar y libro, para todos los items
+    items = CarritoItem.objects.select_related('ejemplar__libro').order_by('id')
+    carrito = (
+        Carrito.objects.filter(cliente_id=request.user.id)
+        .prefetch_related(Prefetch('items', queryset=items))
+        .first()
+    )
+    if carrito is None:
         return Response({'error': 'El carrito no existe.'}, status=status.HTTP_404_NOT_FOUND)
 
     serializer = CarritoSerializer(carrito)
     return Response(serializer.data)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def resumen_carrito(request):
+    # Para la insignia del encabezado: lee los totales mantenidos, sin cargar items
+    resumen = Carrito.objects.filter(cliente_id=request.user.id).values_list('cantidad_items', 'total').first()
+    cantidad_items, total = resumen or (0, Decimal('0.00'))
+    # Mismo formato que CarritoSerializer (decimales como texto)
+    return Response({'cantidad_items': cantidad_items, 'total': str(total)})
+
+
 @api_view(['DELETE'])
 @permission_classes([IsAuthenticated])
 def eliminar_item_carrito(request, item_id):
@@ -671,46 +812,14 @@ def comprar_carrito(request):
     if not cliente.metodos_pago.filter(id=metodo_id, activo=True).exists():
         return Response({'error': 'Método de pago inválido.'}, status=400)
 
-    total = sum(item.subtotal() for item in items)
-
-    # Crear pedido principal
-    pedido = Pedido.objects.create(
-        cliente=cliente,
-        direccion_id=direccion_id,
-        metodo_pago_id=metodo_id,
-        total=total,
-    )
-
-    # Crear los items del pedido
-    for item in items:
-        PedidoItem.objects.create(
-            pedido=pedido,
-            ejemplar=item.ejemplar,
-            cantidad=item.cantidad,
-            precio_unitario=item.ejemplar.precio,
-        )
-        item.ejemplar.disponible = False
-        item.ejemplar.save()
-
-    # Vaciar carrito
-    items.delete()
-
-    ejemplares_codigos = [item.ejemplar.codigo.hex for item in carrito.items.all()]
-
-    # Actualizar historial
-    cliente.historial_compras.append({
-        "total": str(total),
-        "fecha": pedido.fecha_creacion.strftime("%Y-%m-%d %H:%M"),
-        "direccion_id": direccion_id,
-        "metodo_pago_id": metodo_id,
-        "pedido_id": pedido.id,
-        "ejemplares": ejemplares_codigos
-    })
-    cliente.save()
+    try:
+        pedido = procesar_compra(cliente, carrito, direccion_id, metodo_id)
+    except CompraEnConflicto as conflicto:
+        return Response({'error': str(conflicto), 'conflictos': conflicto.conflictos}, status=409)
 
     return Response({
         'message': 'Compra realizada exitosamente.',
-        'total': str(total),
+        'total': str(pedido.total),
         'pedido_id': pedido.id,
         'fecha': pedido.fecha_creacion.strftime("%Y-%m-%d %H:%M")
     }, status=200)
@@ -727,27 +836,16 @@ def crear_reserva(request):
         return Response({'error': 'Solo los clientes pueden hacer reservas.'}, status=status.HTTP_403_FORBIDDEN)
 
     try:
-        ejemplar = Ejemplar.objects.get(id=request.data.get('ejemplar_id'), disponible=True)
-    except Ejemplar.DoesNotExist:
-        return Response({'error': 'Este ejemplar no está disponible.'}, status=status.HTTP_400_BAD_REQUEST)
-
-    # Validar reservas activas del cliente
-    reservas_activas = Reserva.objects.filter(cliente=cliente, activa=True)
-
-    if reservas_activas.count() >= 5:
-        return Response({'error': 'Solo puedes tener máximo 5 libros reservados.'}, status=status.HTTP_400_BAD_REQUEST)
+        ejemplar_id = int(request.data.get('ejemplar_id'))
+    except (TypeError, ValueError):
+        return Response({'error': 'Debe proporcionar el ID del ejemplar a reservar.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Contar reservas activas del mismo libro por este cliente
-    reservas_mismo_libro = reservas_activas.filter(ejemplar__libro=ejemplar.libro).count()
-    if reservas_mismo_libro >= 3:
-        return Response({'error': 'No puedes reservar más de 3 ejemplares del mismo libro.'}, status=status.HTTP_400_BAD_REQUEST)
-
-    serializer = ReservaSerializer(data=request.data)
-    if serializer.is_valid():
-        reserva = serializer.save(cliente=cliente)
-        return Response(ReservaSerializer(reserva).data, status=status.HTTP_201_CREATED)
-    
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    # Cupos (5 reservas vigentes, 3 del mismo libro), reclamo del ejemplar y alta en una sola transacción
+    try:
+        reserva = Reserva.objects.reservar(cliente, ejemplar_id)
+    except (LimiteReservasExcedido, EjemplarNoDisponible) as error:
+        return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(ReservaSerializer(reserva).data, status=status.HTTP_201_CREATED)
 
 
 @api_view(['GET'])
@@ -758,7 +856,7 @@ def listar_reservas_activas(request):
     except Cliente.DoesNotExist:
         return Response({'error': 'Solo los clientes pueden ver reservas.'}, status=status.HTTP_403_FORBIDDEN)
 
-    reservas = Reserva.objects.filter(cliente=cliente, activa=True)
+    reservas = Reserva.objects.vigentes().filter(cliente=cliente).select_related('ejemplar__libro')
     serializer = ReservaSerializer(reservas, many=True)
     return Response(serializer.data)
 
@@ -770,7 +868,7 @@ def listar_reservas_inactivas(request):
     except Cliente.DoesNotExist:
         return Response({'error': 'Solo los clientes pueden ver reservas.'}, status=status.HTTP_403_FORBIDDEN)
 
-    reservas = Reserva.objects.filter(cliente=cliente, activa=False)
+    reservas = Reserva.objects.no_vigentes().filter(cliente=cliente).select_related('ejemplar__libro')
     serializer = ReservaSerializer(reservas, many=True)
     return Response(serializer.data)
 
@@ -795,14 +893,8 @@ def cancelar_reserva(request, reserva_id):
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def verificar_reservas_expiradas(request):
-    # Este endpoint sería llamado manualmente o por CRON en producción
-    reservas = Reserva.objects.filter(activa=True)
-    expiradas = 0
-
-    for reserva in reservas:
-        if timezone.now() >= reserva.fecha_expiracion:
-            reserva.cancelar()
-            expiradas += 1
+    # En producción lo hace el comando `manage.py barrer_reservas --intervalo N`
+    expiradas = Reserva.objects.expirar_todas()
 
     return Response({'message': f'{expiradas} reservas expiradas fueron liberadas.'}, status=status.HTTP_200_OK)
 
@@ -821,41 +913,69 @@ def solicitar_devolucion(request):
     if not ejemplar_id:
         return Response({'error': 'Debe proporcionar el ID del ejemplar a devolver.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    try:
-        ejemplar = Ejemplar.objects.get(id=ejemplar_id)
-    except Ejemplar.DoesNotExist:
+    if not Ejemplar.objects.filter(id=ejemplar_id).exists():
         return Response({'error': 'Ejemplar no encontrado.'}, status=status.HTTP_404_NOT_FOUND)
 
-    # Validar si la compra es reciente (menos de 8 días)
-    historial = cliente.historial_compras
-    compra_valida = False
-    for compra in historial:
-        for compra in historial:
-            for compra in historial:
-                if compra.get('fecha'):
-                    try:
-                        fecha_compra = timezone.datetime.strptime(compra['fecha'], "%Y-%m-%d %H:%M:%S")
-                    except ValueError:
-                        fecha_compra = timezone.datetime.strptime(compra['fecha'], "%Y-%m-%d %H:%M")
-                    fecha_compra = timezone.make_aware(fecha_compra)
-
-                    # Si solo tienes pedido_id pero no la lista de ejemplares:
-                    if 'pedido_id' in compra and compra['pedido_id'] == ejemplar.pedidoitem_set.first().pedido.id:
-                        if (timezone.now() - fecha_compra).days <= 8:
-                            compra_valida = True
-                            break
-
-    if not compra_valida:
+    # Validar si la compra es reciente (8 días o menos), con una consulta sobre sus pedidos
+    if not cliente.puede_devolver(ejemplar_id):
         return Response({'error': 'El tiempo para devolución ha expirado o no se encontró compra reciente.'}, status=status.HTTP_400_BAD_REQUEST)
 
     serializer = DevolucionSerializer(data=request.data, context={'request': request})
     if serializer.is_valid():
+        # Responde sin renderizar el QR: codigo_qr_url lo genera en la primera descarga
         devolucion = serializer.save(cliente=cliente)
-        return Response(DevolucionSerializer(devolucion).data, status=status.HTTP_201_CREATED)
+        return Response(DevolucionSerializer(devolucion, context={'request': request}).data, status=status.HTTP_201_CREATED)
 
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def obtener_devolucion(request, devolucion_id):
+    try:
+        cliente = Cliente.objects.get(id=request.user.id)
+    except Cliente.DoesNotExist:
+        return Response({'error': 'Solo los clientes pueden ver sus devoluciones.'}, status=status.HTTP_403_FORBIDDEN)
+
+    try:
+        devolucion = Devolucion.objects.select_related('cliente', 'ejemplar__libro').get(id=devolucion_id, cliente=cliente)
+    except Devolucion.DoesNotExist:
+        return Response({'error': 'Devolución no encontrada.'}, status=status.HTTP_404_NOT_FOUND)
+
+    return Response(DevolucionSerializer(devolucion, context={'request': request}).data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def qr_devolucion(request, devolucion_id):
+    # Redirige a la URL inmutable del QR actual de la devolución
+    devoluciones = Devolucion.objects.select_related('cliente', 'ejemplar__libro')
+    if not hasattr(request.user, "administrador"):
+        devoluciones = devoluciones.filter(cliente_id=request.user.id)
+    try:
+        devolucion = devoluciones.get(id=devolucion_id)
+    except Devolucion.DoesNotExist:
+        return Response({'error': 'Devolución no encontrada.'}, status=status.HTTP_404_NOT_FOUND)
+
+    return redirect(url_qr(request, devolucion.id, contenido_qr(devolucion)))
+
+
+# Vista de Django y no de DRF: sirve un PNG, y la negociación de contenido de DRF respondería 406
+# a un cliente que solo acepte image/png. No requiere sesión: la huella (HMAC) hace de credencial.
+@condition(etag_func=etag_qr)
+@require_GET
+def qr_devolucion_png(request, devolucion_id, huella):
+    devolucion = Devolucion.objects.select_related('cliente', 'ejemplar__libro').filter(id=devolucion_id).first()
+    contenido = contenido_qr(devolucion) if devolucion else ''
+    if devolucion is None or not hmac.compare_digest(huella_qr(contenido), huella):
+        raise Http404('QR no encontrado.')
+
+    response = HttpResponse(obtener_png(devolucion, contenido), content_type='image/png')
+    # El contenido de esta URL no cambia nunca: si cambian los datos de la devolución cambia la huella
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def listar_mis_devoluciones(request):
@@ -864,7 +984,7 @@ def listar_mis_devoluciones(request):
     except Cliente.DoesNotExist:
         return Response({'error': 'Solo los clientes pueden ver sus devoluciones.'}, status=status.HTTP_403_FORBIDDEN)
 
-    devoluciones = Devolucion.objects.filter(cliente=cliente)
+    devoluciones = Devolucion.objects.filter(cliente=cliente).select_related('cliente', 'ejemplar__libro')
     serializer = DevolucionSerializer(devoluciones, many=True, context={'request': request})
     return Response(serializer.data)
 
@@ -875,15 +995,21 @@ def listar_ejemplares_agotados(request):
     if not hasattr(request.user, "administrador"):
         return Response({'error': 'Solo los administradores pueden ver ejemplares agotados.'}, status=status.HTTP_403_FORBIDDEN)
 
-    ejemplares = Ejemplar.objects.filter(agotado=True)
+    ejemplares = Ejemplar.objects.filter(agotado=True).select_related('libro')
     serializer = EjemplarSerializer(ejemplares, many=True)
     return Response(serializer.data)
 
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@respuesta_cacheada('noticias')
 def listar_noticias(request):
-    noticias = Noticia.objects.select_related('libro').order_by('-fecha_creacion')
+    noticias = Noticia.objects.select_related('libro').order_by('-fecha_creacion', '-id')
+
+    if usa_cursor(request):
+        paginador, pagina = paginar_con_cursor(request, noticias, ('-fecha_creacion', '-id'))
+        return paginador.get_paginated_response(NoticiaSerializer(pagina, many=True).data)
+
     serializer = NoticiaSerializer(noticias, many=True)
     return Response(serializer.data)
 
@@ -981,12 +1107,16 @@ def foro_mensajes(request):
 
     # Listar mensajes
     if hasattr(user, 'administrador'):
-        mensajes = Mensaje.objects.all().order_by('-fecha_creacion')
+        mensajes = Mensaje.objects.all().order_by('-fecha_creacion', '-id')
     elif hasattr(user, 'cliente'):
-        mensajes = Mensaje.objects.filter(cliente=user.cliente).order_by('-fecha_creacion')
+        mensajes = Mensaje.objects.filter(cliente=user.cliente).order_by('-fecha_creacion', '-id')
     else:
         return Response({'error': 'No autorizado.'}, status=403)
 
+    if usa_cursor(request):
+        paginador, pagina = paginar_con_cursor(request, mensajes, ('-fecha_creacion', '-id'))
+        return paginador.get_paginated_response(MensajeSerializer(pagina, many=True).data)
+
     serializer = MensajeSerializer(mensajes, many=True)
     return Response(serializer.data)
 
@@ -1003,22 +1133,19 @@ def listar_pedidos_cliente(request):
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])  # Opcional: solo admins pueden ejecutar
 def avanzar_estado_pedidos(request):
-    ahora = timezone.now()
-    actualizados = []
-
-    for pedido in Pedido.objects.all():
-        segundos = (ahora - pedido.fecha_creacion).total_seconds()
-
-        if pedido.estado == 'EN PREPARACION' and segundos >= 120:
-            pedido.estado = 'ENVIADO'
-            pedido.save()
-            actualizados.append((pedido.id, 'ENVIADO'))
-        elif pedido.estado == 'ENVIADO' and segundos >= 240:
-            pedido.estado = 'ENTREGADO'
-            pedido.save()
-            actualizados.append((pedido.id, 'ENTREGADO'))
+    # Solo recorre los pedidos vencidos (ver PedidoQuerySet.avanzar_estados); en producción
+    # lo ejecuta periódicamente el comando `manage.py avanzar_pedidos --intervalo N`
+    actualizados = Pedido.objects.avanzar_estados()
 
     return Response({
         "mensaje": "Actualización completada",
         "pedidos_actualizados": actualizados
-    })
\ No newline at end of file
+    })
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def ver_estadisticas_cache(request):
+    if not hasattr(request.user, "administrador"):
+        return Response({'error': 'Solo los administradores pueden ver las estadísticas de la caché.'}, status=status.HTTP_403_FORBIDDEN)
+
+    return Response(estadisticas_cache())